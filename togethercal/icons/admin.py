@@ -13,5 +13,9 @@ class IconAdmin(admin.ModelAdmin):
     list_display = ('name', 'keywords')
     inlines = [IconKeywordInline]
 
+    def get_queryset(self, request):
+        # Loads the keywords of all listed icons in one query
+        return super(IconAdmin, self).get_queryset(request).prefetch_related('iconkeyword_set')
+
 
 admin.site.register(Icon, IconAdmin)
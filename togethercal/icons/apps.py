@@ -4,4 +4,8 @@ from django.apps import AppConfig
 
 class IconsConfig(AppConfig):
     name = 'togethercal.icons'
-    verbose_name = u'אייקונים'
\ No newline at end of file
+    verbose_name = u'אייקונים'
+
+    def ready(self):
+        # Connect the signal handlers that create the thumbnails and sprite sheet
+        import images
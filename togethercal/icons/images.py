@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Thumbnails of the icons and a sprite sheet of the month thumbnails, rebuilt when icons change
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from io import BytesIO
+import hashlib
+import json
+import logging
+import os
+
+from models import Icon
+
+
+# Displayed size of the icons in each view, in CSS pixels
+SIZES = {'month': 20, 'day': 48}
+
+# Thumbnails have twice as many pixels, to look sharp on high density screens
+SCALE = 2
+
+# Number of icons in each row of the sprite sheet
+SPRITE_COLUMNS = 16
+
+SPRITE_INFO = 'icons/sprite.json'
+
+SPRITE_CACHE_KEY = 'icons:sprite'
+
+
+def thumbnail_name(image_name, view):
+    directory, filename = os.path.split(image_name)
+    return os.path.join(directory, 'thumbnails', '%s_%s.png' % (os.path.splitext(filename)[0], view))
+
+
+def _open(icon):
+    from PIL import Image
+    try:
+        with icon.image.storage.open(icon.image.name) as f:
+            image = Image.open(f)
+            image.load()
+    except (IOError, OSError):
+        return None
+    return image.convert('RGBA')
+
+
+def _resize(image, size):
+    # Fits the image in a transparent square, keeping its proportions
+    from PIL import Image
+    image = image.copy()
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    square = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    square.paste(image, ((size - image.size[0]) // 2, (size - image.size[1]) // 2))
+    return square
+
+
+def _save(name, image):
+    data = BytesIO()
+    image.save(data, 'PNG', optimize=True)
+    default_storage.delete(name)
+    return default_storage.save(name, ContentFile(data.getvalue()))
+
+
+def create_thumbnails(icon):
+    image = _open(icon)
+    if image is None:
+        logging.warning("Cannot read the image of icon %s" % icon.pk)
+        return
+    for view, size in SIZES.items():
+        _save(thumbnail_name(icon.image.name, view), _resize(image, size * SCALE))
+
+
+def delete_thumbnails(image_name):
+    # Another icon may use the same file
+    if Icon.objects.filter(image=image_name).exists():
+        return
+    for view in SIZES:
+        default_storage.delete(thumbnail_name(image_name, view))
+
+
+def get_sprite():
+    # The url and size of the sprite sheet and the position of each icon in it, in CSS pixels
+    if not settings.ICON_SPRITE:
+        return None
+    # Kept in the shared cache until the sheet is rebuilt (an empty dict when there is none)
+    sprite = cache.get(SPRITE_CACHE_KEY)
+    if sprite is None:
+        sprite = _read_sprite()
+        cache.set(SPRITE_CACHE_KEY, sprite, None)
+    return sprite or None
+
+
+def _read_sprite():
+    if not default_storage.exists(SPRITE_INFO):
+        return {}
+    with default_storage.open(SPRITE_INFO) as f:
+        info = json.loads(f.read())
+    size = SIZES['month']
+    rows = max(info['slots'].values()) // SPRITE_COLUMNS + 1 if info['slots'] else 0
+    return dict(
+        url=default_storage.url(info['name']),
+        width=SPRITE_COLUMNS * size,
+        height=rows * size,
+        positions=dict(
+            (int(pk), (slot % SPRITE_COLUMNS * size, slot // SPRITE_COLUMNS * size))
+            for pk, slot in info['slots'].items()
+        ),
+    )
+
+
+def build_sprite():
+    # Icons keep their slots, so that cached month fragments that refer to them remain valid
+    from PIL import Image
+    previous = None
+    if default_storage.exists(SPRITE_INFO):
+        with default_storage.open(SPRITE_INFO) as f:
+            previous = json.loads(f.read())
+    images = {}
+    for icon in Icon.objects.all():
+        image = _open(icon)
+        if image is not None:
+            images[icon.pk] = image
+    slots = {}
+    if previous:
+        slots.update((int(pk), slot) for pk, slot in previous['slots'].items() if int(pk) in images)
+    used = set(slots.values())
+    free = (slot for slot in xrange(len(images) + len(used)) if slot not in used)
+    for pk in sorted(images):
+        if pk not in slots:
+            slots[pk] = next(free)
+
+    size = SIZES['month'] * SCALE
+    rows = max(slots.values()) // SPRITE_COLUMNS + 1 if slots else 1
+    sheet = Image.new('RGBA', (SPRITE_COLUMNS * size, rows * size), (0, 0, 0, 0))
+    for pk, slot in slots.items():
+        sheet.paste(_resize(images[pk], size), (slot % SPRITE_COLUMNS * size, slot // SPRITE_COLUMNS * size))
+    data = BytesIO()
+    sheet.save(data, 'PNG', optimize=True)
+
+    # The name changes with the content, so that browsers do not use a stale sheet
+    name = 'icons/sprite-%s.png' % hashlib.sha1(data.getvalue()).hexdigest()[:12]
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data.getvalue()))
+    default_storage.delete(SPRITE_INFO)
+    default_storage.save(SPRITE_INFO, ContentFile(json.dumps(dict(name=name, slots=slots))))
+    cache.delete(SPRITE_CACHE_KEY)
+    if previous and previous['name'] != name:
+        default_storage.delete(previous['name'])
+
+
+@receiver(pre_save, sender=Icon)
+def remember_image(sender, instance, **kwargs):
+    if instance.pk:
+        instance._previous_image = Icon.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Icon)
+def update_icon_images(sender, instance, created, **kwargs):
+    # Only a new image needs new thumbnails (uploads never reuse a file name)
+    previous = getattr(instance, '_previous_image', None)
+    if not created and previous == instance.image.name:
+        return
+    if previous:
+        delete_thumbnails(previous)
+    create_thumbnails(instance)
+    if settings.ICON_SPRITE:
+        build_sprite()
+
+
+@receiver(post_delete, sender=Icon)
+def delete_icon_images(sender, instance, **kwargs):
+    delete_thumbnails(instance.image.name)
+    if settings.ICON_SPRITE:
+        build_sprite()
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from togethercal.icons.images import build_sprite, create_thumbnails
+from togethercal.icons.models import Icon
+
+
+class Command(BaseCommand):
+
+    help = 'Creates the thumbnails of all the icons and rebuilds the sprite sheet (e.g. for icons uploaded earlier)'
+
+    def handle(self, *args, **options):
+        for icon in Icon.objects.all():
+            create_thumbnails(icon)
+        if settings.ICON_SPRITE:
+            build_sprite()
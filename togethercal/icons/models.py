@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.encoding import force_text
 
+from collections import defaultdict
 import os
 import random
+import uuid
 
 
 class Icon(models.Model):
@@ -21,8 +27,17 @@ class Icon(models.Model):
         if self.image and not self.name:
             self.name = os.path.basename(os.path.splitext(self.image.name)[0])
 
+    def thumbnail_url(self, view='day'):
+        # Falls back to the original image, if no thumbnail could be made of it
+        from images import thumbnail_name
+        name = thumbnail_name(self.image.name, view)
+        if self.image.storage.exists(name):
+            return self.image.storage.url(name)
+        return self.image.url
+
     def keywords(self):
-        return ', '.join(self.iconkeyword_set.values_list('keyword', flat=True))
+        # Iterates over the related keywords, so that prefetched ones are used
+        return ', '.join(k.keyword for k in self.iconkeyword_set.all())
 
 
 class IconKeyword(models.Model):
@@ -34,15 +49,53 @@ class IconKeyword(models.Model):
         return self.keyword
 
 
+# Maps each normalized keyword to its icons. Built on first use, and rebuilt when
+# icons or keywords change, in this process or (through a version in the shared
+# cache) in any other.
+_keyword_index = None
+_keyword_index_version = None
+
+KEYWORD_INDEX_VERSION_KEY = 'icons:keyword_index_version'
+
+
+def _normalize(text):
+    return u' '.join(force_text(text).lower().split())
+
+
+def get_keyword_index():
+    global _keyword_index, _keyword_index_version
+    version = cache.get(KEYWORD_INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(KEYWORD_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(KEYWORD_INDEX_VERSION_KEY)
+    if _keyword_index is None or version != _keyword_index_version:
+        index = defaultdict(dict)
+        for keyword in IconKeyword.objects.select_related('icon'):
+            index[_normalize(keyword.keyword)][keyword.icon_id] = keyword.icon
+        _keyword_index = index
+        _keyword_index_version = version
+    return _keyword_index
+
+
+@receiver([post_save, post_delete], sender=Icon)
+@receiver([post_save, post_delete], sender=IconKeyword)
+def clear_keyword_index(**kwargs):
+    global _keyword_index
+    _keyword_index = None
+    # Other processes see the change once it is committed
+    transaction.on_commit(lambda: cache.set(KEYWORD_INDEX_VERSION_KEY, uuid.uuid4().hex, None))
+
+
 def icon_for_text(text):
-    candidates = set()
-    words = text.split()
-    # look for word pairs
-    pairs = zip(words[:-1], words[1:])
-    for pair in pairs:
-        candidates.update(Icon.objects.filter(iconkeyword__keyword__iexact=' '.join(pair)))
+    index = get_keyword_index()
+    candidates = {}
+    words = _normalize(text).split()
+    # look for phrases (word pairs or longer)
+    for n in range(2, len(words) + 1):
+        for i in range(len(words) - n + 1):
+            candidates.update(index.get(u' '.join(words[i:i + n]), {}))
     # look for single words
     if not candidates:
         for word in words:
-            candidates.update(Icon.objects.filter(iconkeyword__keyword__iexact=word))
-    return random.choice(list(candidates)) if candidates else None
+            candidates.update(index.get(word, {}))
+    return random.choice(candidates.values()) if candidates else None
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from io import BytesIO
+import shutil
+import tempfile
+
+import images
+import models
+from models import Icon, IconKeyword, icon_for_text
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ICON_SPRITE=False)
+class KeywordIndexTest(TestCase):
+
+    def setUp(self):
+        self.icon = Icon.objects.create(image='icons/cake.png', name='cake')
+
+    def test_change_in_this_process(self):
+        self.assertIsNone(icon_for_text(u'יום הולדת'))
+        IconKeyword.objects.create(icon=self.icon, keyword=u'יום הולדת')
+        self.assertEqual(icon_for_text(u'יום הולדת לדני'), self.icon)
+
+    def test_change_in_another_process(self):
+        self.assertIsNone(icon_for_text(u'יום הולדת'))
+        # Another process adds a keyword (without signals in this one), and bumps the version
+        IconKeyword.objects.bulk_create([IconKeyword(icon=self.icon, keyword=u'יום הולדת')])
+        self.assertIsNone(icon_for_text(u'יום הולדת'))
+        cache.set(models.KEYWORD_INDEX_VERSION_KEY, 'other', None)
+        self.assertEqual(icon_for_text(u'יום הולדת'), self.icon)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ICON_SPRITE=True)
+class IconImagesTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, name):
+        from PIL import Image
+        data = BytesIO()
+        Image.new('RGB', (300, 200), (255, 0, 0)).save(data, 'PNG')
+        return Icon.objects.create(image=SimpleUploadedFile(name, data.getvalue()), name=name)
+
+    def test_thumbnails(self):
+        from PIL import Image
+        icon = self.upload('cake.png')
+        for view, size in images.SIZES.items():
+            name = images.thumbnail_name(icon.image.name, view)
+            self.assertEqual(icon.thumbnail_url(view), default_storage.url(name))
+            with default_storage.open(name) as f:
+                self.assertEqual(Image.open(f).size, (size * images.SCALE, size * images.SCALE))
+
+    def test_sprite_is_cached_until_rebuilt(self):
+        cake = self.upload('cake.png')
+        sprite = images.get_sprite()
+        self.assertEqual(sprite['positions'], {cake.pk: (0, 0)})
+        # Read from the cache, without the storage
+        default_storage.delete(images.SPRITE_INFO)
+        self.assertEqual(images.get_sprite(), sprite)
+        ball = self.upload('ball.png')
+        self.assertEqual(images.get_sprite()['positions'], {cake.pk: (0, 0), ball.pk: (images.SIZES['month'], 0)})
+        cake.delete()
+        self.assertEqual(images.get_sprite()['positions'], {ball.pk: (images.SIZES['month'], 0)})
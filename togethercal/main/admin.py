@@ -27,14 +27,34 @@ class OneTimeEventAdmin(admin.ModelAdmin):
     search_fields = ['title']
 
 
+class CalendarSourceAdmin(admin.ModelAdmin):
+
+    list_display = ['url', 'ignore_past', 'last_fetched', 'status']
+
+
+class InboundMessageAdmin(admin.ModelAdmin):
+
+    list_display = ['subject', 'sender', 'received', 'processed', 'replied', 'attempts']
+    readonly_fields = ['event', 'processed', 'replied', 'attempts', 'error']
+    search_fields = ['subject', 'sender']
+
+
 class OccurrenceAdmin(admin.ModelAdmin):
 
+    list_display = ['date', 'end_date', 'event', 'kind']
+    list_select_related = ['event']
+    list_filter = ['kind']
     date_hierarchy = 'date'
     search_fields = ['event__title']
+    raw_id_fields = ['event']
+    # Counting all the occurrences on every search is slow on a large table
+    show_full_result_count = False
 
 
 admin.site.register(Holiday, HolidayAdmin)
 admin.site.register(SpecialDay, SpecialDayAdmin)
 admin.site.register(WeeklyActivity, WeeklyActivityAdmin)
 admin.site.register(OneTimeEvent, OneTimeEventAdmin)
+admin.site.register(CalendarSource, CalendarSourceAdmin)
+admin.site.register(InboundMessage, InboundMessageAdmin)
 admin.site.register(Occurrence, OccurrenceAdmin)
@@ -5,3 +5,8 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     name = 'togethercal.main'
     verbose_name = u'ראשי'
+
+    def ready(self):
+        # Connect the signal handlers that invalidate cached fragments and tune database connections
+        import database
+        import fragments
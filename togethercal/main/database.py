@@ -0,0 +1,14 @@
+# Applies settings.SQLITE_PRAGMAS (WAL, busy timeout) to new SQLite connections
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def set_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.cursor()
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', ()):
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Parses the dates and times typed by users, with a cache in front of dateparser
+from django.conf import settings
+from django.utils.encoding import force_text
+
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+import threading
+
+
+RELATIVE_DAYS = {
+    u'אתמול': -1,
+    u'היום': 0,
+    u'מחר': 1,
+}
+
+
+class LRUCache(object):
+    # Thread-safe, discarding the least recently used items
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
+_cache = LRUCache(1000)
+_missing = object()
+
+
+def parse(date_str, base=None):
+    # Returns a naive datetime, or None if the text cannot be parsed
+    # An aware base (e.g. a start date that was already parsed) is used in its own time zone
+    base = (base or datetime.now()).replace(tzinfo=None)
+    date_str = u' '.join(force_text(date_str).split())
+    result = _parse_common(date_str, base)
+    if result is None:
+        key = (date_str, base.date())
+        cached = _cache.get(key, _missing)
+        if cached is _missing:
+            result = _dateparser_parse(date_str, base)
+            # Phrases like "3 hours ago" depend on the time of day, so they are compared
+            # with the result at another time of the same day, and cached as an offset
+            other_base = datetime.combine(base.date(), time())
+            if other_base == base:
+                other_base += timedelta(hours=12)
+            other = _dateparser_parse(date_str, other_base)
+            if result == other:
+                _cache.set(key, (None, result))
+            elif result and other and result - base == other - other_base:
+                _cache.set(key, (result - base, None))
+        else:
+            offset, result = cached
+            if offset is not None:
+                result = base + offset
+    return result
+
+
+def _dateparser_parse(date_str, base):
+    # dateparser is slow to import, so it is loaded only when needed
+    import dateparser
+    return dateparser.parse(
+        date_str,
+        languages=[settings.LANGUAGE_CODE],
+        settings=dict(PREFER_DATES_FROM='future', RETURN_AS_TIMEZONE_AWARE=False, RELATIVE_BASE=base)
+    )
+
+
+def _parse_common(date_str, base):
+    # Relative days, optionally followed by a time
+    word, _, rest = date_str.partition(u' ')
+    if word in RELATIVE_DAYS:
+        d = base + timedelta(days=RELATIVE_DAYS[word])
+        if not rest:
+            return d
+        t = _strptime(rest, settings.TIME_INPUT_FORMATS)
+        return datetime.combine(d.date(), t.time()) if t else None
+    # A time by itself refers to its next occurrence
+    t = _strptime(date_str, settings.TIME_INPUT_FORMATS)
+    if t:
+        d = datetime.combine(base.date(), t.time())
+        return d if d >= base else d + timedelta(days=1)
+    return _strptime(date_str, settings.DATETIME_INPUT_FORMATS if u':' in date_str else settings.DATE_INPUT_FORMATS)
+
+
+def _strptime(date_str, formats):
+    for fmt in formats:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            pass
+    return None
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Cache keys of the day and month fragments, evicted after commit when the dates they show change
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from contextlib import contextmanager
+import datetime
+import threading
+
+from togethercal.icons.models import Icon
+from models import CalendarEvent, Occurrence, EVENT_CLASSES
+
+
+def day_key(the_day, anonymous=False):
+    return 'day:%s:%s' % (the_day.isoformat(), 'anonymous' if anonymous else 'user')
+
+
+def month_key(year, month, today=None):
+    # The current month highlights today, so its key changes at midnight
+    today = today or datetime.date.today()
+    if (today.year, today.month) == (year, month):
+        return 'month:%d-%02d:%s' % (year, month, today.isoformat())
+    return 'month:%d-%02d' % (year, month)
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batched():
+    # Evicts the dates invalidated inside the block together, once the transaction commits
+    if getattr(_batch, 'dates', None) is not None:
+        yield
+        return
+    _batch.dates = set()
+    try:
+        yield
+    finally:
+        dates, _batch.dates = _batch.dates, None
+        # Deferred by invalidate_dates until the commit, like any other eviction
+        invalidate_dates(dates)
+
+
+def invalidate_dates(dates):
+    if getattr(_batch, 'dates', None) is not None:
+        _batch.dates.update(dates)
+        return
+    dates = set(dates)
+    months = set((d.year, d.month) for d in dates)
+    keys = [day_key(d, anonymous) for d in dates for anonymous in (False, True)]
+    keys.extend(month_key(year, month) for year, month in months)
+    if keys:
+        # Evicting before the commit would let a concurrent request cache the old data again
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _event_dates(event):
+    # Recurring events have no end, so only the years that are likely to be viewed are covered
+    today = datetime.date.today()
+    start = datetime.date(today.year - 1, 1, 1)
+    end = datetime.date(today.year + 10, 12, 31)
+    return event.occurrence_dates(start, end)
+
+
+@receiver(pre_save)
+def remember_event_dates(sender, instance, **kwargs):
+    if sender in EVENT_CLASSES and instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        instance._previous_dates = _event_dates(previous) if previous else []
+
+
+@receiver([post_save, post_delete])
+def invalidate_event(sender, instance, **kwargs):
+    if sender in EVENT_CLASSES:
+        invalidate_dates(_event_dates(instance) + getattr(instance, '_previous_dates', []))
+
+
+@receiver([post_save, post_delete], sender=Occurrence)
+def invalidate_occurrence(sender, instance, **kwargs):
+    invalidate_dates(instance.dates())
+
+
+@receiver([post_save, post_delete], sender=Icon)
+def invalidate_icon(sender, instance, **kwargs):
+    dates = []
+    for event in CalendarEvent.objects.filter(icon_id=instance.pk).select_subclasses():
+        dates.extend(_event_dates(event))
+    invalidate_dates(dates)
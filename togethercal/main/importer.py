@@ -1,30 +1,107 @@
-import requests
-from icalendar import Calendar
 from datetime import date, timedelta
+import hashlib
+import time
 
-from models import Holiday
+from django.db import transaction
+from django.utils import timezone
+
+import fragments
+from models import CalendarSource, Holiday, Occurrence
 
 
 ONE_DAY = timedelta(days=1)
 
 
 def import_calendar(url, ignore_past=False):
-	r = requests.get(url)
-	r.raise_for_status()
+	# The flag is kept on the source, for the next runs of update_calendars
+	source, _ = CalendarSource.objects.get_or_create(url=url, defaults=dict(ignore_past=ignore_past))
+	if ignore_past and not source.ignore_past:
+		source.ignore_past = True
+		source.save(update_fields=['ignore_past'])
+	update_source(source, fetch_calendar(source), ignore_past)
+
+
+def fetch_calendar(source, timeout=None, retries=0, backoff=1):
+	# Retries with exponential backoff on connection and server errors; does not touch the database
+	import requests
+	headers = {}
+	if source.etag:
+		headers['If-None-Match'] = source.etag
+	if source.last_modified:
+		headers['If-Modified-Since'] = source.last_modified
+	for attempt in range(retries + 1):
+		try:
+			r = requests.get(source.url, headers=headers, timeout=timeout)
+			r.raise_for_status()
+			break
+		except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+			client_error = isinstance(e, requests.HTTPError) and e.response.status_code < 500
+			if client_error or attempt == retries:
+				raise
+			time.sleep(backoff * 2 ** attempt)
 	r.encoding = 'UTF-8'
-	cal = Calendar.from_ical(r.text)
+	return r
+
+
+def update_source(source, r, ignore_past=False):
+	# Records the outcome on the source, also when it fails
+	try:
+		_update_source(source, r, ignore_past)
+	except Exception as e:
+		# The changes were rolled back, so the error is saved separately
+		record_error(source, e)
+		raise
+
+
+def record_error(source, error):
+	source.status = unicode(error)[:200]
+	source.last_fetched = timezone.now()
+	source.save(update_fields=['status', 'last_fetched'])
+
+
+@transaction.atomic
+def _update_source(source, r, ignore_past=False):
+	if r.status_code == 304:
+		source.status = 'Not modified'
+	else:
+		# Weekly activities are expanded around the holidays when displayed, so only the
+		# cached fragments of the affected dates need updating, and they are evicted together
+		with fragments.batched():
+			apply_calendar(source, r.text, ignore_past)
+		source.etag = r.headers.get('ETag')
+		source.last_modified = r.headers.get('Last-Modified')
+		source.status = 'OK'
+	source.last_fetched = timezone.now()
+	source.save()
+
+
+def apply_calendar(source, text, ignore_past=False):
+	from icalendar import Calendar
+	cal = Calendar.from_ical(text)
+	existing = dict((h.uid, h) for h in Holiday.objects.filter(source_url=source.url))
+	seen = set()
+	changed = []
 	for event in cal.walk('vevent'):
+		uid = event.get('uid')
+		seen.add(uid)
 		if ignore_past and event.get('dtend').dt < date.today():
 			continue
-		h, _ = Holiday.objects.update_or_create(
-			source_url=url,
-			uid=event.get('uid'),
-			defaults=dict(
-				title=event.get('summary').encode('UTF-8'),
-				start_date=event.get('dtstart').dt,
-				end_date=event.get('dtend').dt - ONE_DAY
-			)
-		)
+		title = event.get('summary').encode('UTF-8')
+		start_date = event.get('dtstart').dt
+		end_date = event.get('dtend').dt - ONE_DAY
+		content_hash = hashlib.sha1(repr((title, start_date, end_date))).hexdigest()
+		h = existing.get(uid) or Holiday(source_url=source.url, uid=uid)
+		if h.content_hash == content_hash:
+			continue
+		h.title = title
+		h.start_date = start_date
+		h.end_date = end_date
+		h.content_hash = content_hash
 		h.full_clean()
 		h.save()
-		h.create_occurrences()
+		changed.append(h)
+	# Delete holidays that are no longer in the file
+	removed = [holiday.pk for holiday_uid, holiday in existing.items() if holiday_uid not in seen]
+	for i in range(0, len(removed), 500):
+		Holiday.objects.filter(pk__in=removed[i:i + 500]).delete()
+	Occurrence.objects.materialize(changed)
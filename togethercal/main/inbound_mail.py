@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Events sent by email: queued by the webhook, created and replied to by process_inbound_mail
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from datetime import datetime
+import logging
+import traceback
+
+import dateparsing
+from models import InboundMessage, OneTimeEvent
+
+
+class InboundMailForm(forms.ModelForm):
+
+    start_date = forms.CharField(label=u'התחלה', max_length=200)
+    end_date = forms.CharField(label=u'סיום', max_length=200, required=False)
+
+    class Meta:
+        model = OneTimeEvent
+        fields = ('title', 'start_date', 'end_date')
+
+    def _parse_start(self):
+        start = self.cleaned_data.get('start_date', '')
+        if isinstance(start, datetime):
+            return start
+        return dateparsing.parse(start)
+
+    def clean_start_date(self):
+        if self.cleaned_data['start_date']:
+            start = self._parse_start()
+            if not start:
+                raise ValidationError(u'לא ניתן לפרש את התאריך או השעה')
+            start = start.replace(tzinfo=timezone.utc)
+            return start
+
+    def clean_end_date(self):
+        end = self.cleaned_data['end_date']
+        if end:
+            start = self._parse_start()
+            end = dateparsing.parse(end, start)
+            if not end:
+                raise ValidationError(u'לא ניתן לפרש את התאריך או השעה')
+            end = start.replace(tzinfo=timezone.utc)
+            return end
+
+
+def create_event(subject, text):
+    # Returns the event (None if the email could not be parsed) and the html of the reply
+    parts      = text.split(u' עד ')
+    start_date = parts[0]
+    end_date   = parts[1] if len(parts) > 1 else None
+    form       = InboundMailForm(dict(title=subject, start_date=start_date, end_date=end_date))
+    event      = None
+    if form.is_valid():
+        event = form.save()
+        event.create_occurrences()
+    return event, render_to_string('inbound_mail_reply.html', dict(form=form))
+
+
+def process_messages(batch_size=100):
+    # Failed messages are retried on the next run, up to INBOUND_MAIL_MAX_ATTEMPTS times
+    count = 0
+    for messages in _batches(InboundMessage.objects.filter(processed__isnull=True), batch_size):
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    message.event, message.reply = create_event(message.subject, message.text)
+                    message.processed = timezone.now()
+                    message.save()
+                count += 1
+            except Exception:
+                logging.exception("Failed processing inbound message %s" % message.message_id)
+                _record_failure(message, traceback.format_exc())
+    connection = None
+    try:
+        for messages in _batches(InboundMessage.objects.filter(processed__isnull=False, replied__isnull=True), batch_size):
+            # A batch that cannot be sent stays unreplied, and is sent again on the next run
+            try:
+                if connection is None:
+                    connection = get_connection()
+                    connection.open()
+                replies = []
+                for message in messages:
+                    reply = EmailMultiAlternatives(u'Re: %s' % message.subject, '', message.recipient, [message.sender],
+                                                   connection=connection)
+                    reply.attach_alternative(message.reply, 'text/html')
+                    replies.append(reply)
+                connection.send_messages(replies)
+            except Exception:
+                logging.exception("Failed sending replies to %d inbound messages" % len(messages))
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                continue
+            InboundMessage.objects.filter(pk__in=[m.pk for m in messages]).update(replied=timezone.now())
+    finally:
+        if connection is not None:
+            connection.close()
+    return count
+
+
+def _record_failure(message, error):
+    # Undoes what was rolled back. Replying to a message that keeps failing ends its processing
+    message.event, message.reply, message.processed = None, '', None
+    message.attempts += 1
+    message.error = error
+    if message.attempts >= settings.INBOUND_MAIL_MAX_ATTEMPTS:
+        message.reply = render_to_string('inbound_mail_failure.html')
+        message.processed = timezone.now()
+    message.save()
+
+
+def _batches(qs, size):
+    # Pages by primary key, so that messages that were not handled are not fetched again
+    last_pk = 0
+    while True:
+        batch = list(qs.filter(pk__gt=last_pk).order_by('pk')[:size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
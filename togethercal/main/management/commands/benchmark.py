@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from togethercal.main import views
+from togethercal.main.importer import apply_calendar
+from togethercal.main.models import CalendarEvent, CalendarSource, Holiday, Occurrence, OneTimeEvent
+
+from datetime import datetime
+import django
+import io
+import json
+import subprocess
+import sys
+import time
+
+
+# A private cache, so that the benchmark neither uses nor evicts the site's cached fragments
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+
+class Command(BaseCommand):
+
+    help = 'Times the main views, calendar import and occurrence creation, and outputs the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times to run each benchmark')
+        parser.add_argument('--ics', help='Path of a local ical file to benchmark the import with')
+        parser.add_argument('--events', type=int, default=100, help='Number of events to create occurrences for')
+        parser.add_argument('--output', help='File to write the results to, instead of the standard output')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        self.repeat = options['repeat']
+        self.factory = RequestFactory(HTTP_HOST='benchmark')
+        # An unsaved user is enough for login_required, and leaves no trace in the database
+        self.user = User(username='benchmark')
+        results = {}
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            for name, func in self.view_benchmarks():
+                results[name] = self.measure(func, before=cache.clear)
+                results[name + ' (cached)'] = self.measure(func)
+            if options['ics']:
+                with io.open(options['ics'], encoding='UTF-8') as f:
+                    text = f.read()
+                results['import_calendar'] = self.measure(
+                    lambda source: apply_calendar(source, text), self.new_source, rollback=True)
+                results['import_calendar (unchanged)'] = self.measure(
+                    lambda source: apply_calendar(source, text), lambda: self.new_source(text), rollback=True)
+            events = list(
+                CalendarEvent.objects.filter(occurrence__isnull=False).distinct()
+                .order_by('-pk').select_subclasses(Holiday, OneTimeEvent)[:options['events']]
+            )
+            if events:
+                results['create_occurrences'] = self.measure(
+                    lambda: [event.create_occurrences() for event in events],
+                    lambda: self.delete_occurrences(events), rollback=True)
+        report = dict(
+            timestamp=datetime.now().isoformat(),
+            revision=self.revision(),
+            python=sys.version.split()[0],
+            django=django.get_version(),
+            database=settings.DATABASES['default']['ENGINE'],
+            repeat=self.repeat,
+            dataset=dict(
+                events=CalendarEvent.objects.count(),
+                occurrences=Occurrence.objects.count(),
+            ),
+            results=results,
+        )
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def view_benchmarks(self):
+        return (
+            ('day_view', lambda: self.get(views.day_view, '/day/')),
+            ('month_view', lambda: self.get(views.month_view, '/month/')),
+            ('main_view', lambda: self.get(views.main_view, '/')),
+            ('ical_view', lambda: self.get(views.ical_view, '/ical/')),
+        )
+
+    def get(self, view, path):
+        request = self.factory.get(path)
+        request.user = self.user
+        response = view(request)
+        # Streaming responses do their work while being consumed
+        if response.streaming:
+            b''.join(response.streaming_content)
+        assert response.status_code == 200, '%s returned %d' % (path, response.status_code)
+
+    def new_source(self, text=None):
+        source = CalendarSource.objects.create(url='http://benchmark.localhost/calendar.ics')
+        if text:
+            apply_calendar(source, text)
+        return (source,)
+
+    def delete_occurrences(self, events):
+        Occurrence.objects.filter(event__in=[e.pk for e in events]).delete()
+
+    def measure(self, func, before=None, rollback=False):
+        # Timing and query statistics of func; before() is not measured, and rollback undoes each run
+        times = []
+        queries = []
+        for i in range(self.repeat):
+            with transaction.atomic():
+                args = (before and before()) or ()
+                with CaptureQueriesContext(connection) as context:
+                    start = time.time()
+                    func(*args)
+                    times.append(time.time() - start)
+                queries.append(len(context.captured_queries))
+                if rollback:
+                    transaction.set_rollback(True)
+        times.sort()
+        return dict(
+            min=times[0],
+            median=times[len(times) // 2],
+            mean=sum(times) / len(times),
+            max=times[-1],
+            queries=max(queries),
+        )
+
+    def revision(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                           stderr=subprocess.STDOUT).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
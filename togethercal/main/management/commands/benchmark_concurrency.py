@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from togethercal.main.database import set_pragmas
+from togethercal.main.models import Occurrence, OneTimeEvent
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import json
+import random
+import threading
+import time
+
+
+# Title of the events created by the writers, which are deleted at the end
+TITLE = u'[benchmark_concurrency]'
+
+
+class Command(BaseCommand):
+
+    help = 'Measures the throughput of readers and writers using the database in parallel threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Number of reading threads')
+        parser.add_argument('--writers', type=int, default=2, help='Number of writing threads')
+        parser.add_argument('--duration', type=float, default=10, help='Number of seconds to run')
+        parser.add_argument('--without-tuning', action='store_true', default=False,
+                            help='Use the default SQLite settings instead of SQLITE_PRAGMAS, for comparison')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark is meant for SQLite')
+        if options['without_tuning']:
+            connection_created.disconnect(set_pragmas)
+            connection.close()
+            # The journal mode is stored in the database file, so it has to be changed back
+            connection.cursor().execute('PRAGMA journal_mode = DELETE')
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+        connection.close()
+
+        self.stop = time.time() + options['duration']
+        self.lock = threading.Lock()
+        self.times = defaultdict(list)
+        self.errors = defaultdict(int)
+        threads = [threading.Thread(target=self.run, args=(self.read,)) for i in range(options['readers'])]
+        threads += [threading.Thread(target=self.run, args=(self.write,)) for i in range(options['writers'])]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            OneTimeEvent.objects.filter(title=TITLE).delete()
+
+        results = dict(
+            journal_mode=journal_mode,
+            readers=options['readers'],
+            writers=options['writers'],
+            duration=options['duration'],
+            errors=dict(self.errors),
+        )
+        for kind, times in self.times.items():
+            times.sort()
+            results[kind] = dict(
+                per_second=len(times) / options['duration'],
+                median_ms=times[len(times) // 2] * 1000,
+                max_ms=times[-1] * 1000,
+            )
+        self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+
+    def run(self, operation):
+        # Each thread has its own connection, which is closed when it is done
+        try:
+            while time.time() < self.stop:
+                start = time.time()
+                try:
+                    kind = operation()
+                except OperationalError as e:
+                    with self.lock:
+                        self.errors[str(e)] += 1
+                    continue
+                with self.lock:
+                    self.times[kind].append(time.time() - start)
+        finally:
+            connection.close()
+
+    def read(self):
+        d = date.today() + timedelta(days=random.randint(-30, 60))
+        Occurrence.objects.in_range(d, d + timedelta(days=6))
+        return 'reads'
+
+    def write(self):
+        start_date = datetime.combine(date.today() + timedelta(days=random.randint(-30, 60)), datetime.min.time())
+        with transaction.atomic():
+            event = OneTimeEvent.objects.create(
+                title=TITLE,
+                start_date=start_date.replace(hour=10, tzinfo=timezone.utc),
+                end_date=(start_date + timedelta(days=2)).replace(hour=12, tzinfo=timezone.utc)
+            )
+            event.create_occurrences()
+        return 'writes'
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import HttpRequest
+from django.test.utils import CaptureQueriesContext
+
+from togethercal.main.models import CalendarEvent, CalendarSource, Holiday, Occurrence, OneTimeEvent, SpecialDay, \
+    WeeklyActivity
+from togethercal.main.views import _ical_changes
+
+from datetime import date, timedelta
+
+
+class Command(BaseCommand):
+
+    help = 'Prints the query plans of the queries made by the main code paths, to verify their use of indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Names of the scenarios to explain (default: all)')
+        parser.add_argument('--sql', action='store_true', default=False, help='Print the full SQL of each query')
+
+    def handle(self, *args, **options):
+        scenarios = self.scenarios()
+        names = options['scenarios'] or [name for name, func in scenarios]
+        unknown = set(names) - set(name for name, func in scenarios)
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+        explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        full_scans = 0
+        for name, func in scenarios:
+            if name not in names:
+                continue
+            self.stdout.write('== %s' % name)
+            # Runs the code path, undoing any changes, and explains each distinct query it made
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    func()
+                transaction.set_rollback(True)
+            seen = set()
+            for query in context.captured_queries:
+                sql = query['sql']
+                if sql in seen or not sql.startswith('SELECT'):
+                    continue
+                seen.add(sql)
+                self.stdout.write(sql if options['sql'] else sql[:150] + ('...' if len(sql) > 150 else ''))
+                cursor = connection.cursor()
+                cursor.execute(explain + sql)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    # Scanning a table without an index reads all of its rows
+                    if detail.startswith('SCAN') and 'INDEX' not in detail:
+                        full_scans += 1
+                        detail += '  <-- full scan'
+                    self.stdout.write('    %s' % detail)
+            self.stdout.write('')
+        self.stdout.write('%d full table scans' % full_scans)
+
+    def scenarios(self):
+        today = date.today()
+        month_start = today.replace(day=1)
+        month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        source = CalendarSource.objects.first()
+        events = list(CalendarEvent.objects.order_by('-pk').select_subclasses(Holiday, OneTimeEvent)[:10])
+        return (
+            ('day', lambda: Occurrence.objects.in_range(today, today)),
+            ('month', lambda: Occurrence.objects.in_range(month_start, month_end)),
+            ('weekly', lambda: Occurrence.objects.in_range(today, today, WeeklyActivity)),
+            ('special', lambda: Occurrence.objects.in_range(today, today, SpecialDay)),
+            ('ical', lambda: (
+                _ical_changes(HttpRequest()),
+                Occurrence.objects.in_range(month_start, month_start + timedelta(days=settings.ICAL_DAYS_AHEAD),
+                                            (Holiday, SpecialDay, OneTimeEvent))
+            )),
+            ('materialize', lambda: Occurrence.objects.materialize(events)),
+            ('import', lambda: list(Holiday.objects.filter(source_url=source.url if source else ''))),
+        )
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from togethercal.icons import images
+from togethercal.icons.models import Icon, IconKeyword
+from togethercal.main.models import CalendarEvent, Holiday, Occurrence, OneTimeEvent, SpecialDay, WeeklyActivity
+
+from datetime import date, datetime, time, timedelta
+from io import BytesIO
+import random
+import time as clock
+
+
+# Words used both as icon keywords and in event titles, so that icons are matched by keyword as usual
+KEYWORDS = (
+    u'שחייה', u'כדורגל', u'כדורסל', u'טניס', u'ריקוד', u'יוגה', u'פסנתר', u'גיטרה', u'ציור', u'שחמט',
+    u'רופא', u'שיניים', u'חיסון', u'יום הולדת', u'חתונה', u'בר מצווה', u'טיול', u'ים', u'פיקניק', u'מסיבה',
+    u'קניות', u'ספרייה', u'קולנוע', u'הצגה', u'מוזיאון', u'סבתא', u'סבא', u'גן', u'בית ספר', u'אספת הורים',
+    u'חנוכה', u'פסח', u'סוכות', u'פורים', u'שבועות', u'ראש השנה', u'יום כיפור', u'ל"ג בעומר', u'ט"ו בשבט',
+    u'יום העצמאות',
+)
+
+HOLIDAYS = (
+    u'חנוכה', u'פסח', u'סוכות', u'פורים', u'שבועות', u'ראש השנה', u'יום כיפור', u'ל"ג בעומר', u'ט"ו בשבט',
+    u'יום העצמאות', u'יום הזיכרון', u'חופשת קיץ', u'שמחת תורה', u'תשעה באב',
+)
+
+ACTIVITIES = (u'חוג', u'אימון', u'שיעור', u'תרגול')
+
+NAMES = (u'אבא', u'אמא', u'נועה', u'איתי', u'מאיה', u'יונתן', u'תמר', u'עומר', u'שירה', u'דניאל', u'סבתא', u'סבא')
+
+OTHER_WORDS = (u'עם', u'אצל', u'של', u'אחרי', u'לפני', u'ביחד', u'משפחתי', u'חדש', u'גדול', u'קטן')
+
+
+class Command(BaseCommand):
+
+    help = 'Generates random events, occurrences and icons for development and benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--holidays', type=int, default=2000, help='Number of holidays to create')
+        parser.add_argument('--special-days', type=int, default=1000, help='Number of special days to create')
+        parser.add_argument('--weekly', type=int, default=500, help='Number of weekly activities to create')
+        parser.add_argument('--events', type=int, default=3000, help='Number of one time events to create')
+        parser.add_argument('--icons', type=int, default=100, help='Number of icons to create')
+        parser.add_argument('--years', type=int, default=3, help='Number of years around today to spread the events over')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable datasets')
+        parser.add_argument('--clear', action='store_true', default=False,
+                            help='Delete all events, and previously generated icons, first')
+
+    def handle(self, *args, **options):
+        if options['years'] < 1:
+            raise CommandError('--years must be at least 1')
+        self.random = random.Random(options['seed'])
+        today = date.today()
+        self.first_day = today.replace(month=1, day=1) - timedelta(days=365 * (options['years'] // 2))
+        self.days = 365 * options['years']
+        start = clock.time()
+        # The thumbnails and the sprite sheet are made once at the end, instead of after each icon
+        post_save.disconnect(images.update_icon_images, sender=Icon)
+        post_delete.disconnect(images.delete_icon_images, sender=Icon)
+        try:
+            with transaction.atomic():
+                if options['clear']:
+                    Occurrence.objects.all().delete()
+                    CalendarEvent.objects.all().delete()
+                    generated = Icon.objects.filter(image__startswith='icons/generated-')
+                    removed_images = list(generated.values_list('image', flat=True))
+                    generated.delete()
+                existing = Occurrence.objects.count()
+                icons = self.create_icons(options['icons'])
+                events = []
+                for count, factory in ((options['holidays'], self.make_holiday),
+                                       (options['special_days'], self.make_special_day),
+                                       (options['weekly'], self.make_weekly_activity),
+                                       (options['events'], self.make_one_time_event)):
+                    for i in range(count):
+                        event = factory()
+                        # Assigns an icon by keyword, like the forms do
+                        event.clean()
+                        event.save()
+                        events.append(event)
+                Occurrence.objects.materialize(events)
+                created = Occurrence.objects.count() - existing
+        finally:
+            post_save.connect(images.update_icon_images, sender=Icon)
+            post_delete.connect(images.delete_icon_images, sender=Icon)
+        if options['clear']:
+            for name in removed_images:
+                images.delete_thumbnails(name)
+                default_storage.delete(name)
+        for icon in icons:
+            images.create_thumbnails(icon)
+        if settings.ICON_SPRITE:
+            images.build_sprite()
+        self.stdout.write('Created %d events, %d occurrences and %d icons in %.1fs' % (
+            len(events), created, options['icons'], clock.time() - start
+        ))
+
+    def create_icons(self, count):
+        first = Icon.objects.count()
+        icons = []
+        for i in range(count):
+            name = 'generated-%d' % (first + i)
+            icon = Icon.objects.create(image=self.make_image('icons/%s.png' % name), name=name)
+            IconKeyword.objects.bulk_create(
+                IconKeyword(icon=icon, keyword=keyword)
+                for keyword in self.random.sample(KEYWORDS, self.random.randint(1, 3))
+            )
+            icons.append(icon)
+        return icons
+
+    def make_image(self, name):
+        # A colored circle, at the size of a typical uploaded icon
+        from PIL import Image, ImageDraw
+        image = Image.new('RGBA', (256, 256), (0, 0, 0, 0))
+        color = tuple(self.random.randrange(256) for i in range(3))
+        ImageDraw.Draw(image).ellipse((16, 16, 240, 240), fill=color)
+        data = BytesIO()
+        image.save(data, 'PNG')
+        return default_storage.save(name, ContentFile(data.getvalue()))
+
+    def random_date(self):
+        return self.first_day + timedelta(days=self.random.randrange(self.days))
+
+    def random_title(self, *words):
+        extra = self.random.sample(OTHER_WORDS + NAMES, self.random.randint(0, 2))
+        return u' '.join(words + tuple(extra))
+
+    def make_holiday(self):
+        start_date = self.random_date()
+        length = 1 if self.random.random() < 0.7 else self.random.randint(2, 8)
+        return Holiday(
+            title=self.random_title(self.random.choice(HOLIDAYS)),
+            start_date=start_date,
+            end_date=start_date + timedelta(days=length - 1)
+        )
+
+    def make_special_day(self):
+        return SpecialDay(
+            title=self.random_title(u'יום הולדת ל' + self.random.choice(NAMES)),
+            month=self.random.randint(1, 12),
+            day=self.random.randint(1, 28)
+        )
+
+    def make_weekly_activity(self):
+        start_date = self.random_date()
+        start_time = time(self.random.randint(8, 19), self.random.choice((0, 15, 30, 45)))
+        return WeeklyActivity(
+            title=self.random_title(self.random.choice(ACTIVITIES), self.random.choice(KEYWORDS)),
+            start_date=start_date,
+            end_date=start_date + timedelta(days=self.random.randint(60, 300)),
+            day_of_the_week=self.random.randint(0, 6),
+            start_time=start_time,
+            end_time=time(start_time.hour + 1, start_time.minute),
+            include_holidays=self.random.random() < 0.2
+        )
+
+    def make_one_time_event(self):
+        start_date = datetime.combine(self.random_date(), time(self.random.randint(7, 21))).replace(tzinfo=timezone.utc)
+        chance = self.random.random()
+        if chance < 0.7:
+            end_date = start_date + timedelta(hours=self.random.randint(1, 3))
+        elif chance < 0.8:
+            end_date = start_date + timedelta(days=self.random.randint(1, 5))
+        else:
+            end_date = None
+        return OneTimeEvent(title=self.random_title(self.random.choice(KEYWORDS)), start_date=start_date, end_date=end_date)
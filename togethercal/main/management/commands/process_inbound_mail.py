@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from togethercal.main.inbound_mail import process_messages
+
+import logging
+import time
+
+
+class Command(BaseCommand):
+
+    help = 'Creates events from the queued inbound emails and replies to their senders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of messages to handle at a time')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, checking for new messages every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            count = process_messages(options['batch_size'])
+            if count:
+                logging.info("Processed %d inbound messages" % count)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
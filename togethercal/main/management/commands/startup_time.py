@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+import os
+import subprocess
+import sys
+
+
+# Runs in a fresh interpreter, and times every import that loads new modules.
+# The self time of an import excludes the time spent in the imports it triggers.
+PROFILER = r'''
+import __builtin__, json, sys, time
+
+timings = {}
+stack = [0.0]
+original_import = __builtin__.__import__
+
+def module_name(name, globals, level):
+    package = (globals or {}).get('__package__') or (globals or {}).get('__name__', '').rpartition('.')[0]
+    if level != 0 and package and package + '.' + name in sys.modules:
+        return package + '.' + name
+    return name
+
+def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    count = len(sys.modules)
+    stack.append(0.0)
+    start = time.time()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - start
+        children = stack.pop()
+        stack[-1] += elapsed
+        if len(sys.modules) > count:
+            key = module_name(name, globals, level)
+            total, own = timings.get(key, (0.0, 0.0))
+            timings[key] = (total + elapsed, own + elapsed - children)
+
+__builtin__.__import__ = timed_import
+start = time.time()
+target = sys.argv[1]
+if target == 'wsgi':
+    import togethercal.wsgi
+    # The first request loads the url configuration, and with it the views
+    from django.conf import settings
+    __import__(settings.ROOT_URLCONF)
+else:
+    import django
+    from django.core.management import ManagementUtility
+    django.setup()
+    ManagementUtility(['manage.py', target]).fetch_command(target)
+total = time.time() - start
+__builtin__.__import__ = original_import
+sys.stdout.write(json.dumps(dict(total=total, modules=len(sys.modules), imports=timings)))
+'''
+
+
+class Command(BaseCommand):
+
+    help = 'Measures the time it takes to start the web application or management commands, per imported module'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*', default=['wsgi'], help='"wsgi" and/or names of management commands')
+        parser.add_argument('--limit', type=int, default=15, help='Number of slowest modules to list for each target')
+        parser.add_argument('--budget', type=float, help='Fail if any target takes longer than this (in milliseconds)')
+        parser.add_argument('--json', action='store_true', default=False, help='Output the raw measurements as JSON')
+
+    def handle(self, *args, **options):
+        results = dict((target, self.measure(target)) for target in options['targets'])
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        else:
+            for target in options['targets']:
+                self.report(target, results[target], options['limit'])
+        if options['budget']:
+            over = [t for t in options['targets'] if results[t]['total'] * 1000 > options['budget']]
+            if over:
+                raise CommandError('Over the startup budget of %dms: %s' % (options['budget'], ', '.join(over)))
+
+    def measure(self, target):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p or os.curdir for p in sys.path))
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'togethercal.settings')
+        process = subprocess.Popen([sys.executable, '-c', PROFILER, target], env=env, cwd=settings.BASE_DIR,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        if process.returncode:
+            raise CommandError('Failed to start %s:\n%s' % (target, err))
+        return json.loads(out)
+
+    def report(self, target, result, limit):
+        self.stdout.write('%s: %.0fms, %d modules' % (target, result['total'] * 1000, result['modules']))
+        self.stdout.write('  %10s %10s  %s' % ('self', 'total', 'module'))
+        imports = sorted(result['imports'].items(), key=lambda item: -item[1][1])
+        for name, (total, own) in imports[:limit]:
+            self.stdout.write('  %8.1fms %8.1fms  %s' % (own * 1000, total * 1000, name))
@@ -1,22 +1,50 @@
 from django.core.management.base import BaseCommand, CommandError
 
-from infi.django_holiday_calendar.importer import import_calendar
-from infi.django_holiday_calendar.models import HolidayCalendar
+from togethercal.main.importer import fetch_calendar, record_error, update_source
+from togethercal.main.models import CalendarSource
 
+from multiprocessing.pool import ThreadPool
 import logging
+import time
 
 
 class Command(BaseCommand):
 
-    help = 'Updates all existing holiday calendars that have a source url'
+    help = 'Updates the holidays of all calendar sources'
 
     def add_arguments(self, parser):
         parser.add_argument('--ignore-past', action='store_true', default=False, help='Do not import past holidays')
+        parser.add_argument('--threads', type=int, default=4, help='Maximum number of sources to download at once')
+        parser.add_argument('--timeout', type=float, default=30, help='Timeout in seconds for each download')
+        parser.add_argument('--retries', type=int, default=2, help='Number of times to retry a failed download')
 
     def handle(self, *args, **options):
-        for hc in HolidayCalendar.objects.exclude(source_url=None):
-            logging.info("Updating %s (%s)" % (hc, hc.source_url))
+        sources = list(CalendarSource.objects.all())
+        if not sources:
+            return
+
+        def fetch(source):
+            # Runs in a worker thread, so it must not access the database
+            start = time.time()
             try:
-                import_calendar(hc.source_url, hc.country, options['ignore_past'])
-            except:
-                logging.exception("Failed updating %s (%s)" % (hc, hc.source_url))
+                return source, fetch_calendar(source, options['timeout'], options['retries']), None, time.time() - start
+            except Exception as e:
+                return source, None, e, time.time() - start
+
+        # Download all sources in parallel, then apply them one by one
+        pool = ThreadPool(min(options['threads'], len(sources)))
+        try:
+            results = pool.map(fetch, sources)
+        finally:
+            pool.close()
+        for source, r, error, fetch_time in results:
+            start = time.time()
+            if error:
+                logging.error("Failed fetching %s: %s" % (source, error))
+                record_error(source, error)
+            else:
+                try:
+                    update_source(source, r, options['ignore_past'] or source.ignore_past)
+                except:
+                    logging.exception("Failed updating %s" % source)
+            logging.info("%s: %s (fetch %.2fs, apply %.2fs)" % (source, source.status, fetch_time, time.time() - start))
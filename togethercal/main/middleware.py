@@ -0,0 +1,72 @@
+# Logs the queries and render time of each request, and returns them in a Server-Timing header
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('togethercal.timing')
+
+_state = threading.local()
+
+
+def _timed_render(render):
+    def wrapper(self, context):
+        # Included templates are rendered inside their parent, so only the outermost render is timed
+        if getattr(_state, 'template_time', None) is None or _state.depth:
+            return render(self, context)
+        _state.depth += 1
+        start = time.time()
+        try:
+            return render(self, context)
+        finally:
+            _state.template_time += time.time() - start
+            _state.depth -= 1
+    wrapper.timed = True
+    return wrapper
+
+
+class TimingMiddleware(object):
+
+    def __init__(self):
+        if not getattr(Template.render, 'timed', False):
+            Template.render = _timed_render(Template.render)
+
+    def process_request(self, request):
+        # Debug cursors record every query, also when DEBUG is off
+        request._timing_queries = {}
+        for connection in connections.all():
+            request._timing_queries[connection.alias] = (connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+        _state.template_time = 0.0
+        _state.depth = 0
+        request._timing_start = time.time()
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_timing_start'):
+            return response
+        total = time.time() - request._timing_start
+        queries = []
+        for connection in connections.all():
+            force_debug_cursor, first = request._timing_queries.get(connection.alias, (False, 0))
+            queries.extend(list(connection.queries_log)[first:])
+            connection.force_debug_cursor = force_debug_cursor
+        db_time = sum(float(q['time']) for q in queries)
+        template_time = _state.template_time
+        _state.template_time = None
+        response['Server-Timing'] = 'db;dur=%.1f;desc="%d queries", tpl;dur=%.1f, total;dur=%.1f' % (
+            db_time * 1000, len(queries), template_time * 1000, total * 1000
+        )
+        logger.info('%s %s status=%d total=%.1fms db=%.1fms queries=%d templates=%.1fms' % (
+            request.method, request.path, response.status_code, total * 1000, db_time * 1000, len(queries),
+            template_time * 1000
+        ))
+        budget = getattr(settings, 'QUERY_BUDGET', None)
+        if budget is not None and len(queries) > budget:
+            logger.warning('%s %s made %d queries, over the budget of %d' % (
+                request.method, request.path, len(queries), budget
+            ))
+        return response
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def remove_recurring_occurrences(apps, schema_editor):
+    # Special days and weekly activities are now expanded from their rules
+    Occurrence = apps.get_model('main', 'Occurrence')
+    Occurrence.objects.filter(event__specialday__isnull=False).delete()
+    Occurrence.objects.filter(event__weeklyactivity__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_auto_20161029_0536'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_recurring_occurrences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_calendarevent_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarSource',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(unique=True, verbose_name=b'URL')),
+                ('etag', models.CharField(blank=True, max_length=200, null=True, verbose_name=b'ETag')),
+                ('last_modified', models.CharField(blank=True, max_length=100, null=True, verbose_name=b'Last-Modified')),
+            ],
+            options={
+                'verbose_name': 'מקור לוח שנה',
+                'verbose_name_plural': 'מקורות לוח שנה',
+            },
+        ),
+        migrations.AddField(
+            model_name='holiday',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+    ]
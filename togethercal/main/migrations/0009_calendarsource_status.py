@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_calendarsource'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarsource',
+            name='ignore_past',
+            field=models.BooleanField(default=False, verbose_name='\u05d4\u05ea\u05e2\u05dc\u05de\u05d5\u05ea \u05de\u05d7\u05d2\u05d9\u05dd \u05e9\u05e2\u05d1\u05e8\u05d5'),
+        ),
+        migrations.AddField(
+            model_name='calendarsource',
+            name='last_fetched',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='\u05e2\u05d3\u05db\u05d5\u05df \u05d0\u05d7\u05e8\u05d5\u05df'),
+        ),
+        migrations.AddField(
+            model_name='calendarsource',
+            name='status',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True, verbose_name='\u05de\u05e6\u05d1'),
+        ),
+        migrations.AlterField(
+            model_name='calendarsource',
+            name='etag',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True, verbose_name=b'ETag'),
+        ),
+        migrations.AlterField(
+            model_name='calendarsource',
+            name='last_modified',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name=b'Last-Modified'),
+        ),
+    ]
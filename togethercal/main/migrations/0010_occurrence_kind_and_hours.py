@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+HOLIDAY, ONE_TIME_EVENT = 1, 3
+
+
+def fill_kind_and_hours(apps, schema_editor):
+    Occurrence = apps.get_model('main', 'Occurrence')
+    OneTimeEvent = apps.get_model('main', 'OneTimeEvent')
+    Occurrence.objects.filter(event__holiday__isnull=False).update(kind=HOLIDAY)
+    Occurrence.objects.filter(event__onetimeevent__isnull=False).update(kind=ONE_TIME_EVENT)
+    for event in OneTimeEvent.objects.all():
+        occurrences = Occurrence.objects.filter(event_id=event.pk)
+        occurrences.filter(date=event.start_date.date()).update(start_time=event.start_date.time())
+        if event.end_date:
+            occurrences.filter(date=event.end_date.date()).update(end_time=event.end_date.time())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_calendarsource_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occurrence',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, b'Holiday'), (2, b'SpecialDay'), (3, b'OneTimeEvent'), (4, b'WeeklyActivity')], default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='occurrence',
+            name='start_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='occurrence',
+            name='end_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_kind_and_hours, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 11:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_occurrence_kind_and_hours'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboundMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(max_length=255, unique=True, verbose_name=b'Message-Id')),
+                ('sender', models.CharField(max_length=255, verbose_name='\u05de\u05d0\u05ea')),
+                ('recipient', models.CharField(max_length=255, verbose_name='\u05d0\u05dc')),
+                ('subject', models.CharField(max_length=255, verbose_name='\u05e0\u05d5\u05e9\u05d0')),
+                ('text', models.TextField(blank=True, verbose_name='\u05ea\u05d5\u05db\u05df')),
+                ('received', models.DateTimeField(auto_now_add=True, verbose_name='\u05d4\u05ea\u05e7\u05d1\u05dc\u05d4')),
+                ('reply', models.TextField(blank=True, editable=False, verbose_name='\u05ea\u05e9\u05d5\u05d1\u05d4')),
+                ('processed', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='\u05d8\u05d5\u05e4\u05dc\u05d4')),
+                ('replied', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='\u05e0\u05e2\u05e0\u05ea\u05d4')),
+                ('event', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.OneTimeEvent')),
+            ],
+            options={
+                'ordering': ('received',),
+                'verbose_name': '\u05d4\u05d5\u05d3\u05e2\u05d4 \u05e0\u05db\u05e0\u05e1\u05ea',
+                'verbose_name_plural': '\u05d4\u05d5\u05d3\u05e2\u05d5\u05ea \u05e0\u05db\u05e0\u05e1\u05d5\u05ea',
+            },
+        ),
+    ]
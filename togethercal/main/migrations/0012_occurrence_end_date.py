@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import datetime
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def merge_days(apps, schema_editor):
+    # Each run of consecutive days of an event within a month becomes a single occurrence
+    Occurrence = apps.get_model('main', 'Occurrence')
+    runs = []
+    qs = Occurrence.objects.order_by('event_id', 'date').values_list('pk', 'event_id', 'date', 'end_time')
+    for pk, event_id, date, end_time in qs:
+        run = runs[-1] if runs else None
+        if run and run['event_id'] == event_id and run['end_date'] + ONE_DAY == date and date.day != 1:
+            run.update(end_date=date, end_time=end_time)
+            run['merged'].append(pk)
+        else:
+            runs.append(dict(pk=pk, event_id=event_id, end_date=date, end_time=end_time, merged=[]))
+    for run in runs:
+        Occurrence.objects.filter(pk=run['pk']).update(end_date=run['end_date'], end_time=run['end_time'])
+        merged = run['merged']
+        for i in range(0, len(merged), 500):
+            Occurrence.objects.filter(pk__in=merged[i:i + 500]).delete()
+
+
+def split_days(apps, schema_editor):
+    Occurrence = apps.get_model('main', 'Occurrence')
+    days = []
+    for o in Occurrence.objects.exclude(end_date=models.F('date')):
+        d = o.date + ONE_DAY
+        while d <= o.end_date:
+            end_time = o.end_time if d == o.end_date else None
+            days.append(Occurrence(event_id=o.event_id, date=d, end_date=d, kind=o.kind, end_time=end_time))
+            d += ONE_DAY
+        Occurrence.objects.filter(pk=o.pk).update(end_date=o.date, end_time=None)
+    Occurrence.objects.bulk_create(days)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_inboundmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occurrence',
+            name='end_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(merge_days, split_days),
+        migrations.AlterField(
+            model_name='occurrence',
+            name='end_date',
+            field=models.DateField(db_index=True),
+        ),
+    ]
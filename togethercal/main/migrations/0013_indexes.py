@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 11:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_occurrence_end_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='calendarevent',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='\u05e2\u05d3\u05db\u05d5\u05df \u05d0\u05d7\u05e8\u05d5\u05df'),
+        ),
+        migrations.AlterField(
+            model_name='occurrence',
+            name='date',
+            field=models.DateField(),
+        ),
+        migrations.AlterField(
+            model_name='occurrence',
+            name='end_date',
+            field=models.DateField(),
+        ),
+        migrations.AlterField(
+            model_name='weeklyactivity',
+            name='end_date',
+            field=models.DateField(db_index=True, verbose_name='\u05ea\u05d0\u05e8\u05d9\u05da \u05e1\u05d9\u05d5\u05dd'),
+        ),
+        migrations.AlterIndexTogether(
+            name='occurrence',
+            index_together=set([('date', 'end_date'), ('kind', 'date', 'end_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='specialday',
+            index_together=set([('month', 'day')]),
+        ),
+    ]
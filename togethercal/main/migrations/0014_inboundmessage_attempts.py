@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 11:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboundmessage',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='\u05e0\u05d9\u05e1\u05d9\u05d5\u05e0\u05d5\u05ea'),
+        ),
+        migrations.AddField(
+            model_name='inboundmessage',
+            name='error',
+            field=models.TextField(blank=True, editable=False, verbose_name='\u05e9\u05d2\u05d9\u05d0\u05d4'),
+        ),
+    ]
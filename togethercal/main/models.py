@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.query import ModelIterable
 from django.utils.dates import MONTHS
 from django.core.exceptions import ValidationError
 
+from collections import defaultdict
+import copy
 import datetime
-import time
 
 from model_utils.managers import InheritanceManager
 
@@ -14,11 +16,19 @@ from togethercal.icons.models import Icon, icon_for_text
 
 class CalendarEvent(models.Model):
 
-    title = models.CharField(u'כותרת', max_length=200)
-    icon  = models.ForeignKey(Icon, blank=True, null=True)
+    title    = models.CharField(u'כותרת', max_length=200)
+    icon     = models.ForeignKey(Icon, blank=True, null=True)
+    modified = models.DateTimeField(u'עדכון אחרון', auto_now=True, db_index=True)
 
     objects = InheritanceManager()
 
+    # Recurring events are expanded from their rule when queried,
+    # instead of being stored as occurrences
+    recurring = False
+
+    # One of EVENT_KINDS, stored on each occurrence
+    kind = None
+
     def __unicode__(self):
         return self.title
 
@@ -26,16 +36,33 @@ class CalendarEvent(models.Model):
         if not self.icon:
             self.icon = icon_for_text(self.title)
 
-    def create_occurrences(self, *args, **kwargs):
+    def occurrence_dates(self, start_date, end_date, holiday_dates=()):
+        # Holidays in the range are passed in, for events that skip them
         raise NotImplementedError
 
+    @classmethod
+    def active_between(cls, start_date, end_date):
+        # The recurring events that may occur between the two dates
+        raise NotImplementedError
+
+    def create_occurrences(self, *args, **kwargs):
+        Occurrence.objects.materialize([self])
+
     def recreate_occurrences(self):
-        self.occurrence_set.all().delete()
-        self.create_occurrences()
+        # Only the dates that changed are written, so the other occurrences keep their ids
+        Occurrence.objects.materialize([self])
         
     def get_hours(self, date):
         return (None, None)
 
+    def make_occurrence(self, date, end_date=None):
+        # An occurrence may span several consecutive days, starting and ending at the hours of its first and last days
+        end_date = end_date or date
+        return Occurrence(
+            event=self, date=date, end_date=end_date, kind=self.kind,
+            start_time=self.get_hours(date)[0], end_time=self.get_hours(end_date)[1]
+        )
+
 
 class Holiday(CalendarEvent):
 
@@ -43,6 +70,10 @@ class Holiday(CalendarEvent):
     uid         = models.CharField('UID', max_length=200, blank=True, null=True)
     start_date  = models.DateField(u'התחלה')
     end_date    = models.DateField(u'סיום')
+    # Hash of the imported content, used to skip unchanged events on re-import
+    content_hash = models.CharField(max_length=40, blank=True, null=True, editable=False)
+
+    kind = 1
 
     class Meta:
         ordering = ('start_date', 'title')
@@ -59,11 +90,8 @@ class Holiday(CalendarEvent):
         if self.uid == '':
             self.uid = None
 
-    def create_occurrences(self, *args, **kwargs):
-        d = self.start_date
-        while d <= self.end_date:
-            Occurrence.objects.get_or_create(event=self, date=d)
-            d += datetime.timedelta(days=1)
+    def occurrence_dates(self, start_date, end_date, holiday_dates=()):
+        return _date_range(max(start_date, self.start_date), min(end_date, self.end_date))
 
 
 class SpecialDay(CalendarEvent):
@@ -72,20 +100,49 @@ class SpecialDay(CalendarEvent):
     month   = models.PositiveSmallIntegerField(u'חודש', choices=MONTHS.items())
     day     = models.PositiveSmallIntegerField(u'יום', choices=zip(range(1, 32), range(1, 32)))
 
+    recurring = True
+    kind = 2
+
     class Meta:
         ordering = ('month', 'day')
+        index_together = [('month', 'day')]
         verbose_name = u'יום מיוחד'
         verbose_name_plural = u'ימים מיוחדים'
 
-    def create_occurrences(self, *args, **kwargs):
-        year = datetime.date.today().year
-        for y in range(year, year + 10):
+    def occurrence_dates(self, start_date, end_date, holiday_dates=()):
+        dates = []
+        for y in range(start_date.year, end_date.year + 1):
             try:
                 d = datetime.date(y, self.month, self.day)
             except ValueError:
                 # February 29th changes to 28th
                 d = datetime.date(y, self.month, self.day - 1)
-            Occurrence.objects.get_or_create(event=self, date=d)
+            if start_date <= d <= end_date:
+                dates.append(d)
+        return dates
+
+    @classmethod
+    def active_between(cls, start_date, end_date):
+        last = end_date if (end_date - start_date).days < 365 else start_date + datetime.timedelta(days=365)
+        months = set(d.month for d in _date_range(start_date, last))
+        return cls.objects.filter(month__in=months)
+
+
+class CalendarSource(models.Model):
+
+    url           = models.URLField('URL', unique=True)
+    ignore_past   = models.BooleanField(u'התעלמות מחגים שעברו', default=False)
+    last_fetched  = models.DateTimeField(u'עדכון אחרון', blank=True, null=True, editable=False)
+    status        = models.CharField(u'מצב', max_length=200, blank=True, null=True, editable=False)
+    etag          = models.CharField('ETag', max_length=200, blank=True, null=True, editable=False)
+    last_modified = models.CharField('Last-Modified', max_length=100, blank=True, null=True, editable=False)
+
+    class Meta:
+        verbose_name = u'מקור לוח שנה'
+        verbose_name_plural = u'מקורות לוח שנה'
+
+    def __unicode__(self):
+        return self.url
 
 
 DAYS_OF_THE_WEEK = (
@@ -102,12 +159,15 @@ DAYS_OF_THE_WEEK = (
 class WeeklyActivity(CalendarEvent):
 
     start_date       = models.DateField(u'תאריך התחלה')
-    end_date         = models.DateField(u'תאריך סיום')
+    end_date         = models.DateField(u'תאריך סיום', db_index=True)
     day_of_the_week  = models.PositiveSmallIntegerField(u'יום בשבוע', choices=DAYS_OF_THE_WEEK)
     start_time       = models.TimeField(u'שעת התחלה')
     end_time         = models.TimeField(u'שעת סיום')
     include_holidays = models.BooleanField(u'כולל ימי חג', default=False)
 
+    recurring = True
+    kind = 4
+
     class Meta:
         ordering = ('day_of_the_week', 'title')
         verbose_name = u'פעילות שבועית'
@@ -119,21 +179,23 @@ class WeeklyActivity(CalendarEvent):
         if self.start_date and self.end_date and self.start_date > self.end_date:
             raise ValidationError('הסיום לא יכול להיות מוקדם מההתחלה.')
 
-    def create_occurrences(self, *args, **kwargs):
+    def occurrence_dates(self, start_date, end_date, holiday_dates=()):
         # Determine which dates to skip (holidays)
-        skipped_dates = set()
-        if not self.include_holidays:
-            qs = Occurrence.objects.in_range(self.start_date, self.end_date, Holiday)
-            skipped_dates.update(qs.values_list('date', flat=True))
+        skipped_dates = set() if self.include_holidays else holiday_dates
         # Find the first date with the correct weekday
-        d = self.start_date
-        while d.weekday() != self.day_of_the_week:
-            d += datetime.timedelta(days=1)
-        # Create one occurrence per week
-        while d <= self.end_date:
+        d = max(start_date, self.start_date)
+        d += datetime.timedelta(days=(self.day_of_the_week - d.weekday()) % 7)
+        # One occurrence per week
+        dates = []
+        while d <= min(end_date, self.end_date):
             if d not in skipped_dates:
-                Occurrence.objects.get_or_create(event=self, date=d)
-            d += datetime.timedelta(days=7) 
+                dates.append(d)
+            d += datetime.timedelta(days=7)
+        return dates
+
+    @classmethod
+    def active_between(cls, start_date, end_date):
+        return cls.objects.filter(start_date__lte=end_date, end_date__gte=start_date)
 
     def get_hours(self, date):
         return (self.start_time, self.end_time)
@@ -144,6 +206,8 @@ class OneTimeEvent(CalendarEvent):
     start_date  = models.DateTimeField()
     end_date    = models.DateTimeField(blank=True, null=True)
 
+    kind = 3
+
     class Meta:
         ordering = ('start_date', 'title')
         verbose_name = u'אירוע חד פעמי'
@@ -155,11 +219,11 @@ class OneTimeEvent(CalendarEvent):
         if self.start_date and self.end_date and self.start_date > self.end_date:
             raise ValidationError('הסיום לא יכול להיות מוקדם מההתחלה.')
             
-    def create_occurrences(self, *args, **kwargs):
-        d = self.start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        while d <= (self.end_date or self.start_date):
-            Occurrence.objects.get_or_create(event=self, date=d.date())
-            d += datetime.timedelta(days=1)
+    def occurrence_dates(self, start_date, end_date, holiday_dates=()):
+        return _date_range(
+            max(start_date, self.start_date.date()),
+            min(end_date, (self.end_date or self.start_date).date())
+        )
 
     def get_hours(self, date):
         return (
@@ -168,46 +232,232 @@ class OneTimeEvent(CalendarEvent):
         )
 
 
-class OccurrenceManager(models.Manager):
+EVENT_CLASSES = (Holiday, SpecialDay, WeeklyActivity, OneTimeEvent)
+
+EVENT_KINDS = [(cls.kind, cls.__name__) for cls in sorted(EVENT_CLASSES, key=lambda cls: cls.kind)]
+
+
+class OccurrenceQuerySet(models.QuerySet):
+
+    resolve_events = False
+
+    def overlapping(self, start_date, end_date):
+        # Occurrences do not cross month boundaries, so the scan of the date index starts at the first month
+        return self.filter(date__range=(start_date.replace(day=1), end_date), end_date__gte=start_date)
+
+    def with_events(self):
+        # Resolves the events to their subclasses in a single query, once evaluated
+        clone = self._clone()
+        clone.resolve_events = True
+        return clone
+
+    def _clone(self, **kwargs):
+        clone = super(OccurrenceQuerySet, self)._clone(**kwargs)
+        clone.resolve_events = self.resolve_events
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(OccurrenceQuerySet, self)._fetch_all()
+        if self.resolve_events and not fetched and self._iterable_class is ModelIterable:
+            attach_events(self._result_cache)
+
+
+class OccurrenceManager(models.Manager.from_queryset(OccurrenceQuerySet)):
 
     def in_range(self, start_date, end_date, event_class=None):
-        qs = self.filter(date__range=(start_date, end_date))
-        if event_class:
-            qs = qs.filter(event__in=event_class.objects.all())
-        return qs
+        # Occurrences between the two dates (inclusive), one per day, sorted and with their events resolved
+        if event_class is None:
+            event_classes = EVENT_CLASSES
+        else:
+            event_classes = event_class if isinstance(event_class, tuple) else (event_class,)
+        stored_classes = [cls for cls in event_classes if not cls.recurring]
+        occurrences = []
+        holiday_dates = set()
+        if stored_classes:
+            qs = self.overlapping(start_date, end_date)
+            if len(stored_classes) < len([cls for cls in EVENT_CLASSES if not cls.recurring]):
+                qs = qs.filter(kind__in=[cls.kind for cls in stored_classes])
+            for occurrence in qs.with_events():
+                occurrences.extend(occurrence.days(start_date, end_date))
+        if Holiday in event_classes:
+            holiday_dates.update(o.date for o in occurrences if o.kind == Holiday.kind)
+        elif WeeklyActivity in event_classes:
+            qs = self.overlapping(start_date, end_date).filter(kind=Holiday.kind)
+            for first, last in qs.values_list('date', 'end_date'):
+                holiday_dates.update(_date_range(max(first, start_date), min(last, end_date)))
+        for cls in event_classes:
+            if cls.recurring:
+                # No need for the events' ordering, since the occurrences are sorted below
+                for event in cls.active_between(start_date, end_date).select_related('icon').order_by():
+                    for d in event.occurrence_dates(start_date, end_date, holiday_dates):
+                        occurrence = event.make_occurrence(d)
+                        occurrence._event_subclass = event
+                        occurrences.append(occurrence)
+        # Sorted here rather than in SQL: stored intervals are split into days, and the
+        # occurrences of recurring events are merged in
+        occurrences.sort(key=lambda o: (o.date, o.get_sorting_key(), o.event_id))
+        return occurrences
+
+    @transaction.atomic
+    def materialize(self, events):
+        # Creates and deletes only the occurrences that changed, in bulk
+        events = dict((e.pk, e) for e in events if e.pk)
+        if not events:
+            return
+        # Compare the target intervals (first day -> last day) with the existing occurrences
+        target = dict(
+            (e.pk, {} if e.recurring else _intervals(e.occurrence_dates(datetime.date.min, datetime.date.max)))
+            for e in events.values()
+        )
+        existing = defaultdict(set)
+        stale = []
+        updated = defaultdict(list)
+        for event_ids in _chunks(list(target)):
+            qs = self.filter(event__in=event_ids).order_by()
+            qs = qs.values_list('pk', 'event_id', 'date', 'end_date', 'start_time', 'end_time')
+            for pk, event_id, first, last, start_time, end_time in qs:
+                if first not in target[event_id]:
+                    stale.append(pk)
+                    continue
+                existing[event_id].add(first)
+                o = events[event_id].make_occurrence(first, target[event_id][first])
+                if (o.end_date, o.start_time, o.end_time) != (last, start_time, end_time):
+                    updated[(o.end_date, o.start_time, o.end_time)].append(pk)
+        # Apply the differences
+        for (end_date, start_time, end_time), pks in updated.items():
+            for chunk in _chunks(pks):
+                self.filter(pk__in=chunk).update(end_date=end_date, start_time=start_time, end_time=end_time)
+        for pks in _chunks(stale):
+            self.filter(pk__in=pks).delete()
+        self.bulk_create(
+            events[event_id].make_occurrence(first, intervals[first])
+            for event_id, intervals in target.items()
+            for first in sorted(set(intervals) - existing[event_id])
+        )
 
 
 class Occurrence(models.Model):
 
-    event = models.ForeignKey(CalendarEvent)
-    date  = models.DateField(db_index=True)
+    event      = models.ForeignKey(CalendarEvent)
+    # The first and last days of the occurrence, which are in the same month
+    date       = models.DateField()
+    end_date   = models.DateField()
+    # Copied from the event, for sorting and display without loading it
+    kind       = models.PositiveSmallIntegerField(choices=EVENT_KINDS)
+    start_time = models.TimeField(blank=True, null=True)
+    end_time   = models.TimeField(blank=True, null=True)
 
     objects = OccurrenceManager()
 
     class Meta:
         ordering = ('date',)
         unique_together = ('event', 'date')
+        index_together = [('date', 'end_date'), ('kind', 'date', 'end_date')]
         verbose_name = u'היקרות'
         verbose_name_plural = u'היקרויות'
 
     def __unicode__(self):
         return self.date.isoformat() + ' ' + self.event.title
 
+    def dates(self):
+        return _date_range(self.date, self.end_date)
+
+    def days(self, start_date, end_date):
+        # One occurrence per day between the two dates, with that day's hours
+        if self.date == self.end_date:
+            return [self]
+        days = []
+        for d in _date_range(max(start_date, self.date), min(end_date, self.end_date)):
+            o = copy.copy(self)
+            o.date = o.end_date = d
+            o.start_time = self.start_time if d == self.date else None
+            o.end_time = self.end_time if d == self.end_date else None
+            days.append(o)
+        return days
+
     def get_event_as_subclass(self):
-        return CalendarEvent.objects.get_subclass(pk=self.event_id)
+        if not hasattr(self, '_event_subclass'):
+            attach_events([self])
+        return self._event_subclass
 
     def event_class_name(self):
-        return self.get_event_as_subclass().__class__.__name__
-        
+        return self.get_kind_display()
+
     def get_sorting_key(self):
-        event = self.get_event_as_subclass()
-        if isinstance(event, Holiday):
+        if self.kind == Holiday.kind:
             return -20
-        if isinstance(event, SpecialDay):
+        if self.kind == SpecialDay.kind:
             return -10
-        if isinstance(event, OneTimeEvent):
-            return time.mktime(event.start_date.timetuple())
-        return time.mktime(datetime.datetime.combine(self.date, event.start_time).timetuple())
+        # Minutes since midnight. Events that continue from a previous day come first.
+        return self.start_time.hour * 60 + self.start_time.minute if self.start_time else -1
 
     def get_hours(self):
-        return self.get_event_as_subclass().get_hours(self.date)
+        return (self.start_time, self.end_time)
+
+
+class InboundMessage(models.Model):
+    # An email from the inbound mail webhook, queued until its event is created and replied to
+
+    message_id = models.CharField('Message-Id', max_length=255, unique=True)
+    sender     = models.CharField(u'מאת', max_length=255)
+    recipient  = models.CharField(u'אל', max_length=255)
+    subject    = models.CharField(u'נושא', max_length=255)
+    text       = models.TextField(u'תוכן', blank=True)
+    received   = models.DateTimeField(u'התקבלה', auto_now_add=True)
+    event      = models.ForeignKey(OneTimeEvent, blank=True, null=True, on_delete=models.SET_NULL, editable=False)
+    reply      = models.TextField(u'תשובה', blank=True, editable=False)
+    processed  = models.DateTimeField(u'טופלה', blank=True, null=True, editable=False)
+    replied    = models.DateTimeField(u'נענתה', blank=True, null=True, editable=False)
+    attempts   = models.PositiveIntegerField(u'ניסיונות', default=0, editable=False)
+    error      = models.TextField(u'שגיאה', blank=True, editable=False)
+
+    class Meta:
+        ordering = ('received',)
+        verbose_name = u'הודעה נכנסת'
+        verbose_name_plural = u'הודעות נכנסות'
+
+    def __unicode__(self):
+        return self.subject
+
+
+def attach_events(occurrences):
+    # Caches the events (as subclasses, with icons) on the occurrences
+    event_ids = set(o.event_id for o in occurrences)
+    events = {}
+    for ids in _chunks(list(event_ids)):
+        events.update((e.pk, e) for e in CalendarEvent.objects.filter(pk__in=ids).select_subclasses())
+    # Subclass instances do not keep related objects joined through the parent,
+    # so the icons are fetched separately
+    icons = Icon.objects.in_bulk(set(e.icon_id for e in events.values() if e.icon_id))
+    for e in events.values():
+        if e.icon_id:
+            e.icon = icons[e.icon_id]
+    for o in occurrences:
+        o._event_subclass = o.event = events[o.event_id]
+
+
+def _date_range(start, end):
+    dates = []
+    d = start
+    while d <= end:
+        dates.append(d)
+        d += datetime.timedelta(days=1)
+    return dates
+
+
+def _intervals(dates):
+    # Maps the first day of each run of consecutive dates within a month to its last day
+    intervals = {}
+    first = last = None
+    for d in sorted(dates):
+        if last is None or d != last + datetime.timedelta(days=1) or d.day == 1:
+            first = d
+        intervals[first] = last = d
+    return intervals
+
+
+def _chunks(items, size=500):
+    # Keeps the number of query parameters within SQLite's limits
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
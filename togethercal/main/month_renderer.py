@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 from django.utils.html import escape
 from django.conf import settings
+from django.core.cache import cache
 
-from calendar import HTMLCalendar, month_name
+from calendar import HTMLCalendar, month_name, monthrange
+from collections import defaultdict
 import datetime
 from itertools import chain
 
+from togethercal.icons.images import get_sprite
+from fragments import month_key
 from models import Occurrence, OneTimeEvent, Holiday, SpecialDay
 
 
@@ -18,11 +22,39 @@ class MonthRenderer(HTMLCalendar):
         return ''
 
     def formatmonth(self, theyear, themonth, withyear=True):
-        self.year = theyear
-        self.month = themonth
-        self.occurrences = list(Occurrence.objects.filter(date__year=theyear, date__month=themonth))
-        self.occurrences.sort(key=lambda o: o.get_sorting_key())
-        return super(MonthRenderer, self).formatmonth(theyear, themonth, withyear)
+        key = month_key(theyear, themonth)
+        html = cache.get(key)
+        if html is None:
+            self.year = theyear
+            self.month = themonth
+            self.index = self.build_index(theyear, themonth)
+            html = super(MonthRenderer, self).formatmonth(theyear, themonth, withyear)
+            cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+        return html
+
+    def build_index(self, theyear, themonth):
+        # The holiday titles and icon html of each date, resolved once for the whole month
+        sprite = get_sprite()
+        start = datetime.date(theyear, themonth, 1)
+        end = start.replace(day=monthrange(theyear, themonth)[1])
+        index = defaultdict(lambda: ([], []))
+        for occurrence in Occurrence.objects.in_range(start, end, (Holiday, SpecialDay, OneTimeEvent)):
+            event = occurrence.get_event_as_subclass()
+            holidays, icons = index[occurrence.date]
+            if isinstance(event, Holiday):
+                holidays.append(escape(event.title))
+            elif isinstance(event, (SpecialDay, OneTimeEvent)):
+                icons.append(self.format_icon(event, sprite))
+        return index
+
+    def format_icon(self, event, sprite):
+        # Icons in the sprite sheet are shown by their offset in it (its url is set in month.html)
+        if sprite and event.icon_id in sprite['positions']:
+            return '<span class="icon" style="background-position: -%dpx -%dpx" title="%s"></span>' % (
+                sprite['positions'][event.icon_id] + (escape(event.title),)
+            )
+        icon = event.icon.thumbnail_url('month') if event.icon else '/static/bell.png'
+        return '<img src="%s", title="%s">' % (icon, escape(event.title))
 
     def formatweekday(self, day):
         return '<th class="%s">%s</th>' % (self.cssclasses[day], u'בגדהושא'[day])
@@ -35,17 +67,13 @@ class MonthRenderer(HTMLCalendar):
             if datetime.date.today() == curdate:
                 classes.add('today')
             content = []
-            for occurrence in self.occurrences:
-                if occurrence.date == curdate:
-                    event = occurrence.get_event_as_subclass()
-                    if isinstance(event, Holiday):
-                        classes.add('holiday')
-                        content.append(escape(event.title) + '<br>')
-                    elif isinstance(event, (SpecialDay, OneTimeEvent)):
-                        if not content:
-                            content.append('<br>')
-                        icon = event.icon.image.url if event.icon else '/static/bell.png'
-                        content.append('<img src="%s", title="%s">' % (icon, escape(event.title)))
+            holidays, icons = self.index.get(curdate, ((), ()))
+            if holidays:
+                classes.add('holiday')
+                content.extend(title + '<br>' for title in holidays)
+            elif icons:
+                content.append('<br>')
+            content.extend(icons)
             cssclass = ' '.join(classes)
             return self.day_cell(curdate.strftime(settings.DATE_INPUT_FORMATS[0]), cssclass, day, ''.join(content))
         return self.day_cell('noday', 'noday', '', '')
@@ -1,3 +1,589 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-# Create your tests here.
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from datetime import date, datetime, time, timedelta
+import json
+import requests
+import socket
+import threading
+import time as clock
+
+import dateparsing
+import fragments
+import importer
+import inbound_mail
+import views
+from importer import fetch_calendar, import_calendar, update_source
+from inbound_mail import create_event, process_messages
+from models import CalendarSource, Holiday, InboundMessage, Occurrence, OneTimeEvent, SpecialDay, WeeklyActivity
+
+
+class DateParsingTest(TestCase):
+
+    def test_time_after_aware_base(self):
+        base = datetime(2017, 3, 5, 10, 0, tzinfo=timezone.utc)
+        self.assertEqual(dateparsing.parse(u'11:30', base), datetime(2017, 3, 5, 11, 30))
+        self.assertEqual(dateparsing.parse(u'09:30', base), datetime(2017, 3, 6, 9, 30))
+
+    def test_relative_day_with_aware_base(self):
+        base = datetime(2017, 3, 5, 10, 0, tzinfo=timezone.utc)
+        self.assertEqual(dateparsing.parse(u'מחר 08:00', base), datetime(2017, 3, 6, 8, 0))
+
+    def test_cached_time_relative_phrase(self):
+        self.assertEqual(dateparsing.parse(u'לפני 3 שעות', datetime(2017, 3, 5, 9, 0)), datetime(2017, 3, 5, 6, 0))
+        self.assertEqual(dateparsing.parse(u'לפני 3 שעות', datetime(2017, 3, 5, 15, 0)), datetime(2017, 3, 5, 12, 0))
+        self.assertEqual(dateparsing.parse(u'בעוד 2 ימים', datetime(2017, 3, 5, 9, 0)), datetime(2017, 3, 7, 9, 0))
+        self.assertEqual(dateparsing.parse(u'בעוד 2 ימים', datetime(2017, 3, 5, 15, 0)), datetime(2017, 3, 7, 15, 0))
+
+    def test_inbound_mail_with_end_time(self):
+        event, html = create_event(u'פגישה', u'מחר 10:00 עד 11:30')
+        self.assertIsNotNone(event)
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        self.assertEqual(event.start_date, datetime.combine(tomorrow, datetime.min.time()).replace(
+            hour=10, tzinfo=timezone.utc))
+
+
+ICS = u'''BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//togethercal//tests//HE\r
+BEGIN:VEVENT\r
+UID:holiday@tests\r
+SUMMARY:%s\r
+DTSTART;VALUE=DATE:%s\r
+DTEND;VALUE=DATE:%s\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+
+class FakeResponse(object):
+    # Stands for the response that fetch_calendar returns
+
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.headers = {}
+
+
+def holiday_calendar(title, day):
+    return ICS % (title, day.strftime('%Y%m%d'), (day + timedelta(days=1)).strftime('%Y%m%d'))
+
+
+def summary(occurrences):
+    return [(o.date, o.get_event_as_subclass().title) for o in occurrences]
+
+
+class InRangeTest(TestCase):
+
+    def weekly(self, title, **kwargs):
+        # Mondays from March 6th to March 27th 2017
+        fields = dict(title=title, start_date=date(2017, 3, 6), end_date=date(2017, 3, 27), day_of_the_week=0,
+                      start_time=time(17, 0), end_time=time(18, 0))
+        fields.update(kwargs)
+        return WeeklyActivity.objects.create(**fields)
+
+    def holiday(self, title, start_date, end_date=None):
+        holiday = Holiday.objects.create(title=title, start_date=start_date, end_date=end_date or start_date)
+        holiday.create_occurrences()
+        return holiday
+
+    def test_special_days(self):
+        SpecialDay.objects.create(title=u'יום נישואין', month=3, day=12)
+        SpecialDay.objects.create(title=u'יום הולדת', month=3, day=14)
+        self.assertEqual(summary(Occurrence.objects.in_range(date(2017, 3, 1), date(2017, 3, 13))), [
+            (date(2017, 3, 12), u'יום נישואין'),
+        ])
+        self.assertEqual(summary(Occurrence.objects.in_range(date(2016, 3, 13), date(2018, 3, 13))), [
+            (date(2016, 3, 14), u'יום הולדת'),
+            (date(2017, 3, 12), u'יום נישואין'),
+            (date(2017, 3, 14), u'יום הולדת'),
+            (date(2018, 3, 12), u'יום נישואין'),
+        ])
+
+    def test_february_29th(self):
+        SpecialDay.objects.create(title=u'יום הולדת', month=2, day=29)
+        self.assertEqual(summary(Occurrence.objects.in_range(date(2016, 2, 1), date(2017, 3, 31))), [
+            (date(2016, 2, 29), u'יום הולדת'),
+            (date(2017, 2, 28), u'יום הולדת'),
+        ])
+
+    def test_weekly_activity_week_boundaries(self):
+        self.weekly(u'חוג')
+        # Starts on the Tuesday after the first Monday, and ends on the last Monday
+        occurrences = Occurrence.objects.in_range(date(2017, 3, 7), date(2017, 3, 27))
+        self.assertEqual(summary(occurrences), [
+            (date(2017, 3, 13), u'חוג'),
+            (date(2017, 3, 20), u'חוג'),
+            (date(2017, 3, 27), u'חוג'),
+        ])
+        self.assertEqual(occurrences[0].get_hours(), (time(17, 0), time(18, 0)))
+        # The activity's own dates limit it as well
+        self.assertEqual(summary(Occurrence.objects.in_range(date(2017, 2, 26), date(2017, 3, 12))), [
+            (date(2017, 3, 6), u'חוג'),
+        ])
+        self.assertEqual(Occurrence.objects.in_range(date(2017, 3, 28), date(2017, 4, 30)), [])
+
+    def test_weekly_activity_on_holidays(self):
+        self.weekly(u'חוג')
+        self.weekly(u'חוג בחגים', include_holidays=True)
+        self.holiday(u'פורים', date(2017, 3, 12), date(2017, 3, 13))
+        expected = [
+            (date(2017, 3, 6), u'חוג'),
+            (date(2017, 3, 6), u'חוג בחגים'),
+            (date(2017, 3, 12), u'פורים'),
+            (date(2017, 3, 13), u'פורים'),
+            (date(2017, 3, 13), u'חוג בחגים'),
+            (date(2017, 3, 20), u'חוג'),
+            (date(2017, 3, 20), u'חוג בחגים'),
+        ]
+        self.assertEqual(summary(Occurrence.objects.in_range(date(2017, 3, 1), date(2017, 3, 20))), expected)
+        # The holidays are looked up also when only weekly activities are requested
+        self.assertEqual(
+            summary(Occurrence.objects.in_range(date(2017, 3, 1), date(2017, 3, 20), WeeklyActivity)),
+            [item for item in expected if item[1] != u'פורים']
+        )
+
+    def test_recurring_events_are_not_stored(self):
+        self.weekly(u'חוג').create_occurrences()
+        SpecialDay.objects.create(title=u'יום הולדת', month=3, day=14).create_occurrences()
+        self.assertEqual(Occurrence.objects.count(), 0)
+
+
+class IntervalTest(TestCase):
+
+    def event(self, start, end):
+        event = OneTimeEvent.objects.create(title=u'טיול', start_date=start.replace(tzinfo=timezone.utc),
+                                            end_date=end.replace(tzinfo=timezone.utc))
+        event.create_occurrences()
+        return event
+
+    def test_event_across_months(self):
+        event = self.event(datetime(2017, 3, 30, 16, 0), datetime(2017, 4, 2, 12, 0))
+        self.assertEqual(list(event.occurrence_set.order_by('date').values_list('date', 'end_date')), [
+            (date(2017, 3, 30), date(2017, 3, 31)),
+            (date(2017, 4, 1), date(2017, 4, 2)),
+        ])
+        occurrences = Occurrence.objects.in_range(date(2017, 3, 31), date(2017, 4, 30))
+        self.assertEqual([(o.date, o.get_hours()) for o in occurrences], [
+            (date(2017, 3, 31), (None, None)),
+            (date(2017, 4, 1), (None, None)),
+            (date(2017, 4, 2), (None, time(12, 0))),
+        ])
+        self.assertEqual(Occurrence.objects.overlapping(date(2017, 4, 3), date(2017, 4, 30)).count(), 0)
+        self.assertEqual(Occurrence.objects.overlapping(date(2017, 3, 1), date(2017, 3, 30)).count(), 1)
+
+    def test_ids_kept_on_materialize(self):
+        event = self.event(datetime(2017, 3, 30, 16, 0), datetime(2017, 4, 2, 12, 0))
+        ids = dict(event.occurrence_set.values_list('date', 'pk'))
+        # The first days stay the same, and only the last one changes
+        event.end_date = datetime(2017, 4, 5, 9, 0, tzinfo=timezone.utc)
+        event.save()
+        event.recreate_occurrences()
+        self.assertEqual(list(event.occurrence_set.order_by('date').values_list('pk', 'date', 'end_date', 'end_time')), [
+            (ids[date(2017, 3, 30)], date(2017, 3, 30), date(2017, 3, 31), None),
+            (ids[date(2017, 4, 1)], date(2017, 4, 1), date(2017, 4, 5), time(9, 0)),
+        ])
+
+    def test_changes_updated_together(self):
+        events = [self.event(datetime(2017, 3, day, 16, 0), datetime(2017, 3, 10, 18, 0)) for day in (5, 6, 7)]
+        for event in events:
+            event.start_date = event.start_date.replace(hour=17)
+            event.save()
+        with CaptureQueriesContext(connection) as context:
+            Occurrence.objects.materialize(events)
+        self.assertEqual(len([q for q in context.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(set(Occurrence.objects.values_list('start_time', flat=True)), set([time(17, 0)]))
+
+
+class IntervalMigrationTest(TransactionTestCase):
+
+    before = [('main', '0011_inboundmessage')]
+    after = [('main', '0012_occurrence_end_date')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_round_trip(self):
+        apps = self.migrate(self.before)
+        OneTimeEvent = apps.get_model('main', 'OneTimeEvent')
+        Occurrence = apps.get_model('main', 'Occurrence')
+        event = OneTimeEvent.objects.create(title=u'טיול', start_date=datetime(2017, 3, 30, 16, 0, tzinfo=timezone.utc))
+        days = [date(2017, 3, 30), date(2017, 3, 31), date(2017, 4, 1), date(2017, 4, 3)]
+        for d in days:
+            Occurrence.objects.create(event_id=event.pk, date=d, kind=3,
+                                      start_time=time(16, 0) if d == days[0] else None,
+                                      end_time=time(12, 0) if d == days[-1] else None)
+
+        Occurrence = self.migrate(self.after).get_model('main', 'Occurrence')
+        self.assertEqual(list(Occurrence.objects.order_by('date').values_list('date', 'end_date', 'start_time',
+                                                                             'end_time')), [
+            (date(2017, 3, 30), date(2017, 3, 31), time(16, 0), None),
+            (date(2017, 4, 1), date(2017, 4, 1), None, None),
+            (date(2017, 4, 3), date(2017, 4, 3), None, time(12, 0)),
+        ])
+
+        Occurrence = self.migrate(self.before).get_model('main', 'Occurrence')
+        self.assertEqual(list(Occurrence.objects.order_by('date').values_list('date', 'start_time', 'end_time')), [
+            (date(2017, 3, 30), time(16, 0), None),
+            (date(2017, 3, 31), None, None),
+            (date(2017, 4, 1), None, None),
+            (date(2017, 4, 3), None, time(12, 0)),
+        ])
+
+
+class OccurrencesViewTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('dad', password='secret')
+        self.client.login(username='dad', password='secret')
+        SpecialDay.objects.create(title=u'יום הולדת', month=3, day=14)
+
+    def get(self, **params):
+        return self.client.get(reverse('occurrences'), params)
+
+    def test_range(self):
+        response = self.get(start='2017-03-01', end='2017-03-31')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual((data['start'], data['end']), ('2017-03-01', '2017-03-31'))
+        self.assertEqual([(o['date'], o['title'], o['type']) for o in data['occurrences']],
+                         [('2017-03-14', u'יום הולדת', 'SpecialDay')])
+
+    def test_invalid_range(self):
+        for params in (dict(start='2017-03-31', end='2017-03-01'), dict(start='14.3.2017'), dict(offset='x'),
+                       dict(start='9999-12-01', end='9999-12-31'), dict(offset='99999999'), dict(count='-99999999')):
+            self.assertEqual(self.get(**params).status_code, 400, params)
+
+    def test_size_limit(self):
+        self.assertEqual(self.get(start='2017-01-01', end='2017-12-31').status_code, 200)
+        self.assertEqual(self.get(start='2017-01-01', end='2018-01-02').status_code, 400)
+
+
+class ICalViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST='localhost')
+        self.birthday = SpecialDay.objects.create(title=u'יום הולדת', month=3, day=14)
+        self.meeting = OneTimeEvent.objects.create(title=u'אסיפה', start_date=timezone.now() + timedelta(days=1))
+        self.meeting.create_occurrences()
+
+    def get(self, etag=None):
+        headers = dict(HTTP_IF_NONE_MATCH=etag) if etag else {}
+        return self.client.get(reverse('ical'), **headers)
+
+    def assertChanges(self, etag):
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(etag).status_code, 304)
+
+    def test_edit_changes_etag(self):
+        etag = self.get()['ETag']
+        self.meeting.title = u'אסיפת הורים'
+        self.meeting.save()
+        self.assertChanges(etag)
+
+    def test_deletion_changes_etag(self):
+        etag = self.get()['ETag']
+        # Deleting the latest modified event leaves an older modification time
+        self.meeting.delete()
+        self.assertChanges(etag)
+
+    def test_new_month_changes_etag(self):
+        etag = self.get()['ETag']
+        next_month = (date.today().replace(day=1) + timedelta(days=31)).replace(day=1)
+        self.addCleanup(setattr, views, 'date', views.date)
+        views.date = type('date', (date,), dict(today=classmethod(lambda cls: next_month)))
+        self.assertChanges(etag)
+
+    def test_body(self):
+        body = ''.join(self.get().streaming_content)
+        from icalendar import Calendar
+        cal = Calendar.from_ical(body)
+        self.assertEqual(cal.name, 'VCALENDAR')
+        self.assertTrue(body.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), len(cal.walk('VEVENT')))
+        summaries = set(e['summary'] for e in cal.walk('VEVENT'))
+        self.assertEqual(summaries, set([u'יום הולדת', u'אסיפה']))
+
+
+class CalendarImportTest(TestCase):
+
+    def setUp(self):
+        self.source = CalendarSource.objects.create(url='http://calendar.example.com/holidays.ics')
+
+    def test_status_of_import(self):
+        update_source(self.source, FakeResponse(holiday_calendar(u'פורים', date(2017, 3, 12))))
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.status, 'OK')
+        self.assertEqual(Holiday.objects.get().title, u'פורים')
+
+    def test_status_of_failed_import(self):
+        with self.assertRaises(ValueError):
+            update_source(self.source, FakeResponse(u'BEGIN:VCALENDAR\r\nBROKEN'))
+        self.source.refresh_from_db()
+        self.assertTrue(self.source.status)
+        self.assertNotEqual(self.source.status, 'OK')
+        self.assertIsNotNone(self.source.last_fetched)
+
+
+class CalendarServer(ThreadingMixIn, HTTPServer):
+    # Stands for the servers of the calendar sources. Each path answers with its
+    # responses in turn, repeating the last one.
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), CalendarRequestHandler)
+        self.responses = {}
+        self.requests = []
+        self.delay = 0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_port, path)
+
+
+class CalendarRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            responses = server.responses[self.path]
+            status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        clock.sleep(server.delay)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class CalendarFetchTest(TestCase):
+
+    def setUp(self):
+        self.server = CalendarServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        # Records the backoff instead of waiting
+        self.sleeps = []
+        self.addCleanup(setattr, importer, 'time', importer.time)
+        importer.time = type('Time', (), dict(sleep=staticmethod(self.sleeps.append)))
+
+    def source(self, path, *responses, **kwargs):
+        self.server.responses[path] = list(responses)
+        return CalendarSource.objects.create(url=self.server.url(path), **kwargs)
+
+    def calendar(self, title, day, **headers):
+        return 200, headers, holiday_calendar(title, day).encode('UTF-8')
+
+    def test_not_modified(self):
+        source = self.source('/holidays.ics', self.calendar(u'פורים', date(2017, 3, 12), ETag='"1"'), (304, {}, ''))
+        update_source(source, fetch_calendar(source))
+        self.assertEqual((source.status, source.etag), ('OK', '"1"'))
+        update_source(source, fetch_calendar(source))
+        self.assertEqual(self.server.requests[1][1].get('if-none-match'), '"1"')
+        source.refresh_from_db()
+        self.assertEqual(source.status, 'Not modified')
+        self.assertEqual(Holiday.objects.get().title, u'פורים')
+
+    def test_retries_server_errors(self):
+        source = self.source('/holidays.ics', (503, {}, ''), (500, {}, ''), self.calendar(u'פורים', date(2017, 3, 12)))
+        self.assertEqual(fetch_calendar(source, retries=2, backoff=1).status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.sleeps, [1, 2])
+
+    def test_gives_up_after_retries(self):
+        source = self.source('/holidays.ics', (503, {}, ''))
+        with self.assertRaises(requests.HTTPError):
+            fetch_calendar(source, retries=2, backoff=1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        source = self.source('/holidays.ics', (404, {}, ''))
+        with self.assertRaises(requests.HTTPError):
+            fetch_calendar(source, retries=2)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_import_calendar_keeps_ignore_past(self):
+        self.server.responses['/holidays.ics'] = [self.calendar(u'פורים', date(2017, 3, 12))]
+        import_calendar(self.server.url('/holidays.ics'), ignore_past=True)
+        self.assertTrue(CalendarSource.objects.get().ignore_past)
+        self.assertEqual(Holiday.objects.count(), 0)
+
+    def test_update_calendars(self):
+        ok = self.source('/ok.ics', self.calendar(u'פורים', date(2017, 3, 12)))
+        missing = self.source('/missing.ics', (404, {}, ''))
+        broken = self.source('/broken.ics', (200, {}, 'BEGIN:VCALENDAR\r\nBROKEN'))
+        self.server.delay = 0.2
+        call_command('update_calendars', threads=3, retries=0)
+        self.assertEqual(self.server.max_active, 3)
+        for source in (ok, missing, broken):
+            source.refresh_from_db()
+            self.assertIsNotNone(source.last_fetched)
+        self.assertEqual(ok.status, 'OK')
+        self.assertIn('404', missing.status)
+        self.assertNotIn(broken.status, ('OK', None))
+        self.assertEqual(Holiday.objects.get().title, u'פורים')
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, messages):
+        raise socket.error(111, 'Connection refused')
+
+
+class InboundMailTest(TestCase):
+
+    def post(self, **extra):
+        data = {'from': 'dad@example.com', 'to': 'cal@example.com', 'subject': u'רופא שיניים', 'text': u'מחר 10:00'}
+        data.update(extra)
+        return self.client.post(reverse('inbound_mail'), data)
+
+    def queue(self, text=u'מחר 10:00'):
+        return InboundMessage.objects.create(message_id='<%d@example.com>' % InboundMessage.objects.count(),
+                                             sender='dad@example.com', recipient='cal@example.com',
+                                             subject=u'רופא שיניים', text=text)
+
+    def test_repeated_delivery_is_queued_once(self):
+        headers = 'From: dad@example.com\nMessage-ID: <1@example.com>\n'
+        self.post(headers=headers)
+        self.post(headers=headers)
+        self.assertEqual(list(InboundMessage.objects.values_list('message_id', flat=True)), ['<1@example.com>'])
+        self.post(headers='From: dad@example.com\nMessage-ID: <2@example.com>\n')
+        self.assertEqual(InboundMessage.objects.count(), 2)
+
+    def test_repeated_delivery_without_message_id(self):
+        self.assertEqual(self.post().content, 'OK')
+        self.post()
+        self.assertEqual(InboundMessage.objects.count(), 1)
+        self.assertEqual(OneTimeEvent.objects.count(), 0)
+
+    def test_process_messages(self):
+        message = self.queue()
+        self.assertEqual(process_messages(), 1)
+        message.refresh_from_db()
+        self.assertEqual(OneTimeEvent.objects.get(), message.event)
+        self.assertIsNotNone(message.replied)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['dad@example.com'])
+        self.assertIn(u'האירוע נוסף', mail.outbox[0].alternatives[0][0])
+        # Nothing is left to do on the next run
+        self.assertEqual(process_messages(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unparsable_message_is_answered(self):
+        message = self.queue(u'בלה בלה')
+        process_messages()
+        message.refresh_from_db()
+        self.assertIsNone(message.event)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(u'האירוע לא נוסף', mail.outbox[0].alternatives[0][0])
+
+    def test_failing_message_is_retried_and_given_up(self):
+        def fail(subject, text):
+            raise ValueError('failed')
+        create_event = inbound_mail.create_event
+        inbound_mail.create_event = fail
+        self.addCleanup(setattr, inbound_mail, 'create_event', create_event)
+        message = self.queue()
+        with self.settings(INBOUND_MAIL_MAX_ATTEMPTS=2):
+            process_messages()
+            message.refresh_from_db()
+            self.assertEqual(message.attempts, 1)
+            self.assertIn('ValueError: failed', message.error)
+            self.assertIsNone(message.processed)
+            self.assertEqual(len(mail.outbox), 0)
+            process_messages()
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertIsNotNone(message.replied)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(u'תקלה', mail.outbox[0].alternatives[0][0])
+        self.assertEqual(OneTimeEvent.objects.count(), 0)
+
+    def test_failing_reply_is_sent_again(self):
+        message = self.queue()
+        with override_settings(EMAIL_BACKEND='togethercal.main.tests.FailingEmailBackend'):
+            self.assertEqual(process_messages(), 1)
+        message.refresh_from_db()
+        self.assertIsNotNone(message.processed)
+        self.assertIsNone(message.replied)
+        process_messages()
+        message.refresh_from_db()
+        self.assertIsNotNone(message.replied)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OneTimeEvent.objects.count(), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FragmentInvalidationTest(TransactionTestCase):
+
+    def setUp(self):
+        self.day = date.today() + timedelta(days=3)
+        self.keys = [fragments.day_key(self.day), fragments.month_key(self.day.year, self.day.month)]
+        cache.set_many(dict((key, 'old') for key in self.keys))
+
+    def create_event(self):
+        event = OneTimeEvent.objects.create(
+            title=u'ארוחת ערב', start_date=datetime.combine(self.day, datetime.min.time()).replace(tzinfo=timezone.utc)
+        )
+        event.create_occurrences()
+
+    def test_evicted_after_commit(self):
+        with transaction.atomic():
+            self.create_event()
+            self.assertEqual(cache.get_many(self.keys), dict((key, 'old') for key in self.keys))
+        self.assertEqual(cache.get_many(self.keys), {})
+
+    def test_kept_after_rollback(self):
+        try:
+            with transaction.atomic():
+                self.create_event()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(cache.get_many(self.keys), dict((key, 'old') for key in self.keys))
+
+    def test_import_evicted_after_commit(self):
+        source = CalendarSource.objects.create(url='http://calendar.example.com/holidays.ics')
+        with transaction.atomic():
+            update_source(source, FakeResponse(holiday_calendar(u'חנוכה', self.day)))
+            self.assertEqual(Holiday.objects.get().title, u'חנוכה')
+            self.assertEqual(cache.get_many(self.keys), dict((key, 'old') for key in self.keys))
+        self.assertEqual(cache.get_many(self.keys), {})
@@ -1,24 +1,33 @@
 # -*- coding: utf-8 -*-
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django import forms
 from django.conf import settings
-from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 from django.core.urlresolvers import reverse
 from django.db import transaction
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 
-import dateparser
+from collections import defaultdict
 from datetime import datetime, date, timedelta, time
+from email.parser import HeaderParser
+import hashlib
 import logging
-import pytz
-from dateutil.relativedelta import relativedelta
 
-from models import Occurrence, OneTimeEvent, SpecialDay, WeeklyActivity
+import dateparsing
+import fragments
+import inbound_mail
+from models import CalendarEvent, Holiday, InboundMessage, Occurrence, OneTimeEvent, SpecialDay, WeeklyActivity
+
+
+# Number of days rendered into the main page's slider up front, and in total
+PRELOADED_DAYS = 7
+SLIDER_DAYS = 30
 
 
 @login_required
@@ -26,26 +35,83 @@ def main_view(request):
     offset = 0
     dt = _parse(request.GET.get('dt', 'היום')).date()
     offset = (dt - date.today()).days
-    days = [day_view(request, offset + i).content for i in range(3)]
+    days = _render_days(request, dt, PRELOADED_DAYS)
+    empty_days = range(SLIDER_DAYS - len(days))
     return render(request, 'main.html', locals())
 
 
 @login_required
 def month_view(request, offset=None):
+    from dateutil.relativedelta import relativedelta
     from month_renderer import MonthRenderer
+    from togethercal.icons.images import get_sprite
     offset = offset or int(request.GET.get('offset', 0))
     the_day = date.today().replace(day=1) + relativedelta(months=offset)
     renderer = MonthRenderer()
     month_html = renderer.formatmonth(the_day.year, the_day.month)
+    sprite = get_sprite()
     return render(request, 'month.html', locals())
 
 
 def day_view(request, offset=None):
     offset = offset or int(request.GET.get('offset', 0))
     the_day = date.today() + timedelta(days=offset)
-    occurrences = list(Occurrence.objects.filter(date=the_day))
-    occurrences.sort(key=lambda o: o.get_sorting_key())
-    return render(request, 'day.html', locals())
+    return HttpResponse(_render_days(request, the_day, 1)[0])
+
+
+def _render_days(request, first_day, count):
+    # Fetches the occurrences of all the missing days at once
+    anonymous = request.user.is_anonymous()
+    all_days = [first_day + timedelta(days=i) for i in range(count)]
+    keys = dict((the_day, fragments.day_key(the_day, anonymous)) for the_day in all_days)
+    cached = cache.get_many(keys.values())
+    missing_days = [the_day for the_day in all_days if keys[the_day] not in cached]
+    if missing_days:
+        occurrences_by_date = defaultdict(list)
+        for occurrence in Occurrence.objects.in_range(missing_days[0], missing_days[-1]):
+            occurrences_by_date[occurrence.date].append(occurrence)
+        template = get_template('day.html')
+        rendered = {}
+        for the_day in missing_days:
+            occurrences = occurrences_by_date[the_day]
+            rendered[keys[the_day]] = template.render(dict(the_day=the_day, occurrences=occurrences), request)
+        cache.set_many(rendered, settings.FRAGMENT_CACHE_TIMEOUT)
+        cached.update(rendered)
+    return [cached[keys[the_day]] for the_day in all_days]
+
+
+# Longest date range that can be requested from occurrences_view
+MAX_API_DAYS = 366
+
+
+@login_required
+def occurrences_view(request):
+    # A date range from start to end (YYYY-MM-DD), or count days starting offset days from today
+    try:
+        if 'start' in request.GET:
+            start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
+            end = datetime.strptime(request.GET.get('end', request.GET['start']), '%Y-%m-%d').date()
+        else:
+            start = date.today() + timedelta(days=int(request.GET.get('offset', 0)))
+            end = start + timedelta(days=int(request.GET.get('count', 1)) - 1)
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest('Invalid date range')
+    # The last year is left out, since recurring events are expanded a little past the end of the range
+    if not 0 <= (end - start).days < MAX_API_DAYS or end.year == date.max.year:
+        return HttpResponseBadRequest('Invalid date range')
+    items = []
+    for occurrence in Occurrence.objects.in_range(start, end):
+        event = occurrence.get_event_as_subclass()
+        items.append(dict(
+            id=occurrence.event_id,
+            date=occurrence.date.isoformat(),
+            type=occurrence.event_class_name(),
+            title=event.title,
+            icon=event.icon.thumbnail_url() if event.icon else None,
+            hours=[t.strftime('%H:%M') if t else None for t in occurrence.get_hours()],
+            sort_key=occurrence.get_sorting_key()
+        ))
+    return JsonResponse(dict(start=start.isoformat(), end=end.isoformat(), occurrences=items))
 
 
 @login_required
@@ -68,8 +134,7 @@ def form_view(request, form_type):
 @login_required
 @transaction.atomic
 def edit_view(request, pk):
-    occurrence = get_object_or_404(Occurrence, pk=pk)
-    event = occurrence.get_event_as_subclass()
+    event = get_object_or_404(CalendarEvent.objects.select_subclasses(), pk=pk)
     if request.POST.get('action') == 'delete':
         event.delete()
         return HttpResponseRedirect(reverse('main') + '?' + request.META['QUERY_STRING'])
@@ -83,20 +148,43 @@ def edit_view(request, pk):
     return render(request, 'form.html', locals())
 
 
+def _ical_changes(request):
+    # Computed once per request. There is no Last-Modified header, since deleting an
+    # event or the start of a new month changes the feed without a newer modification
+    if not hasattr(request, '_ical_changes'):
+        request._ical_changes = CalendarEvent.objects.aggregate(count=Count('pk'), modified=Max('modified'))
+    return request._ical_changes
+
+
+def _ical_etag(request):
+    # The feed starts at the current month, so it changes when the month does
+    changes = _ical_changes(request)
+    modified = changes['modified'].isoformat() if changes['modified'] else ''
+    key = '%s|%s|%d|%d|%s' % (request.META['HTTP_HOST'], date.today().replace(day=1), settings.ICAL_DAYS_AHEAD,
+                              changes['count'], modified)
+    return hashlib.md5(key).hexdigest()
+
+
+@condition(etag_func=_ical_etag)
 def ical_view(request):
     from icalendar import Calendar, Event, Alarm
     start = date.today().replace(day=1)
-    end = start + timedelta(days=365)
+    end = start + timedelta(days=settings.ICAL_DAYS_AHEAD)
+    host = request.META['HTTP_HOST']
     cal = Calendar()
-    cal.add('prodid', '-//TogetherCal//%s//HE' % request.META['HTTP_HOST'])
+    cal.add('prodid', '-//TogetherCal//%s//HE' % host)
     cal.add('version', '1.0')
-    cal['dtstart'] = start
-    cal['dtend'] = end
-    for occurrence in Occurrence.objects.filter(date__range=(start, end)).iterator():
-        e = occurrence.get_event_as_subclass()
-        if not isinstance(e, WeeklyActivity):
+    cal.add('dtstart', start)
+    cal.add('dtend', end)
+
+    def generate():
+        # Stream the calendar's properties first, and then one event at a time
+        footer = 'END:VCALENDAR\r\n'
+        yield cal.to_ical()[:-len(footer)]
+        for occurrence in Occurrence.objects.in_range(start, end, (Holiday, SpecialDay, OneTimeEvent)):
+            e = occurrence.get_event_as_subclass()
             event = Event()
-            event.add('uid', '%d@%s' % (occurrence.pk, request.META['HTTP_HOST']))
+            event.add('uid', '%d-%s@%s' % (occurrence.event_id, occurrence.date.strftime('%Y%m%d'), host))
             event.add('summary', e.title)
             event.add('dtstamp', occurrence.date)
             event.add('class', 'PRIVATE')
@@ -106,76 +194,46 @@ def ical_view(request):
             alarm.add('description', e.title)
             alarm.add('trigger', timedelta(hours=-1))
             event.add_component(alarm)
-            cal.add_component(event)
-    response = HttpResponse(cal.to_ical(), content_type='text/calendar')
+            yield event.to_ical()
+        yield footer
+
+    response = StreamingHttpResponse(generate(), content_type='text/calendar')
     response['Content-Disposition'] = 'filename="family.ics"'
     return response
 
 
 @csrf_exempt
-@transaction.atomic
 def inbound_mail_view(request):
-    data       = request.POST or request.GET
-    sender     = data['from']
-    recipient  = data['to']
-    subject    = data['subject']
-    text       = data['text']
-    parts      = text.split(u' עד ')
-    start_date = parts[0]
-    end_date   = parts[1] if len(parts) > 1 else None
-    form       = InboundMailForm(dict(title=subject, start_date=start_date, end_date=end_date))
-    if form.is_valid():
-        e = form.save()
-        e.create_occurrences()
-    msg = render_to_string('inbound_mail_reply.html', dict(form=form))
+    data = request.POST or request.GET
     if request.GET: # for debugging
-        return HttpResponse(msg)
-    else:
-        send_mail(u'Re: %s' % subject, '', recipient, [sender], html_message=msg, fail_silently=False)
-        return HttpResponse('OK')
+        with transaction.atomic():
+            return HttpResponse(inbound_mail.create_event(data['subject'], data['text'])[1])
+    # Queue the message, and leave the slow work to the process_inbound_mail command.
+    # Messages that are delivered again are recognized by their id.
+    InboundMessage.objects.get_or_create(message_id=_inbound_message_id(data), defaults=dict(
+        sender=data['from'],
+        recipient=data['to'],
+        subject=data['subject'],
+        text=data['text']
+    ))
+    return HttpResponse('OK')
+
+
+def _inbound_message_id(data):
+    # The id is taken from the raw headers that are posted along with the message
+    headers = HeaderParser().parsestr(data.get('headers', u'').encode('UTF-8'))
+    message_id = headers.get('Message-Id') or data.get('Message-Id')
+    if message_id:
+        return message_id.strip()[:255]
+    # Without an id, identical messages are only treated as repeated deliveries within the
+    # same hour, so that sending the same email again later still creates an event
+    return hashlib.sha1(u'|'.join((
+        timezone.now().strftime('%Y-%m-%d %H'), data['from'], data['to'], data['subject'], data['text']
+    )).encode('UTF-8')).hexdigest()
 
 
 def _parse(date_str, base=None):
-    base = base or datetime.now()
-    return dateparser.parse(
-        date_str, 
-        languages=[settings.LANGUAGE_CODE],
-        settings=dict(PREFER_DATES_FROM='future', RETURN_AS_TIMEZONE_AWARE=False, RELATIVE_BASE=base)
-    )
-
-
-class InboundMailForm(forms.ModelForm):
-
-    start_date = forms.CharField(label=u'התחלה', max_length=200)
-    end_date = forms.CharField(label=u'סיום', max_length=200, required=False)
-
-    class Meta:
-        model = OneTimeEvent
-        fields = ('title', 'start_date', 'end_date')
-
-    def _parse_start(self):
-        start = self.cleaned_data.get('start_date', '')
-        if isinstance(start, datetime):
-            return start
-        return _parse(start)
-
-    def clean_start_date(self):
-        if self.cleaned_data['start_date']:
-            start = self._parse_start()
-            if not start:
-                raise ValidationError(u'לא ניתן לפרש את התאריך או השעה')
-            start = start.replace(tzinfo=pytz.UTC)
-            return start
-
-    def clean_end_date(self):
-        end = self.cleaned_data['end_date']
-        if end:
-            start = self._parse_start()
-            end = _parse(end, start)
-            if not end:
-                raise ValidationError(u'לא ניתן לפרש את התאריך או השעה')
-            end = start.replace(tzinfo=pytz.UTC)
-            return end
+    return dateparsing.parse(date_str, base)
 
 
 class OneTimeEventForm(forms.ModelForm):
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -59,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'togethercal.main.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -97,9 +99,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Reuse connections across requests instead of opening one (and setting its pragmas) per request
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# Applied in this order to each new SQLite connection. WAL lets readers proceed during a write,
+# and busy_timeout (in milliseconds) makes writers wait for a lock instead of failing at once.
+# A negative cache_size is in KiB.
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 10000),
+    ('cache_size', -16000),
+    ('mmap_size', 64 * 1024 * 1024),
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -138,6 +154,42 @@ DATETIME_INPUT_FORMATS = ('%d.%m.%Y %H:%M', '%d/%m/%Y %H:%M', '%Y-%m-%d %H:%M',
 TIME_INPUT_FORMATS = ('%H:%M',)
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# A shared backend lets the importer and other commands invalidate the web workers' fragments
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+# How many days ahead of the current month the iCal feed covers. Special days are
+# expanded from their rules up to this horizon on each request, so it never runs out
+
+ICAL_DAYS_AHEAD = 365
+
+
+# Requests that make more queries than this are logged as warnings (None to disable)
+
+QUERY_BUDGET = 20
+
+
+# Inbound messages that fail this many times are given up on, and their senders are told so
+
+INBOUND_MAIL_MAX_ATTEMPTS = 5
+
+
+# Whether the month view shows the icons from a single sprite sheet, which is rebuilt
+# whenever an icon changes. Clear the cache after changing it, to re-render the months
+
+ICON_SPRITE = True
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
@@ -162,3 +214,11 @@ BOOTSTRAP3 = {
 }
 
 from local_settings import *
+
+# Tests use a cache of their own, which is not shared with the server
+if 'test' in sys.argv[1:2]:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
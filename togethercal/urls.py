@@ -24,6 +24,7 @@ from togethercal.main import views
 
 urlpatterns = [
     url(r'^day/$', views.day_view, name="day"),
+    url(r'^occurrences/$', views.occurrences_view, name="occurrences"),
     url(r'^add/$', views.add_view, name="add"),
     url(r'^form/(O|S|W)/$', views.form_view, name="form"),
     url(r'^edit/(\d+)/$', views.edit_view, name="edit"),